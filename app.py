@@ -1,34 +1,52 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request, Form, status
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request, Form, Query, status
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+from fastapi.exceptions import RequestValidationError
+from fastapi.exception_handlers import request_validation_exception_handler
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, and_, desc, update
+from sqlalchemy.orm import joinedload
 from typing import Optional
-import json
+from datetime import datetime
 
-from models import Trip, User, get_db, create_tables
-from services import create_demo_users, get_tourist_place_by_id
-from websocket_manager import ConnectionManager
-from config import INDIAN_TOURIST_PLACES, GEOFENCE_CENTER, get_allowed_origins
-from auth import verify_token, get_user_from_cookie_token, get_current_active_user, get_current_active_user_flexible
-from schemas import LocationUpdate
+from models import Role, Trip, User, GuideLocation, AsyncSessionLocal, get_db, create_tables
+from services import ACTIVE_TRIP_BY_USER, count_active_trips_by_guide, create_demo_users, get_geofence_by_id, get_tourist_place_by_id, DEFAULT_GEOFENCE, get_ws_context, stream_active_trip_rows, stream_json_array, sync_tourist_places, TOURIST_PLACE_OPTIONS_HTML, VALID_LOCATION_IDS
+from websocket_manager import ConnectionManager, encode_message
+from redis_client import close_redis
+from location_writer import start_location_writer, stop_location_writer
+from responses import OrjsonResponse
+from config import CREATE_DEMO_USERS, GEOFENCE_CENTER, REDIS_URL, WEB_CONCURRENCY, is_allowed_origin
+from auth import get_user_from_cookie_token, get_current_active_user, get_current_active_user_flexible
+from schemas import LocationUpdate, coordinate_error_message
+from page_templates import templates
 
 # Import routers
 from routers.auth import router as auth_router
-from routers.admin import router as admin_router  
-from routers.tourist import router as tourist_router
+from routers.admin import router as admin_router, get_tourist_places  
+from routers.tourist import router as tourist_router, update_location, get_map_data
 from routers.guide import router as guide_router
 from routers.guide_auth import router as guide_auth_router
 
-app = FastAPI(title="Smart Tourist Safety Monitoring System")
+app = FastAPI(title="Smart Tourist Safety Monitoring System", default_response_class=OrjsonResponse)
 
-# Mount static files and templates
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    """Bad coordinates get a 400 with a plain message (what the location clients expect); other errors stay 422"""
+    message = coordinate_error_message(exc.errors())
+    if message is None:
+        return await request_validation_exception_handler(request, exc)
+    return OrjsonResponse({"detail": message}, status_code=status.HTTP_400_BAD_REQUEST)
+
+# Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+
+# Auth pages without an error/message banner are static, so render them once up front
+LOGIN_PAGE_HTML = templates.get_template("login.html").render()
+REGISTER_PAGE_HTML = templates.get_template("register.html").render()
+STATIC_PAGE_HEADERS = {"Cache-Control": "private, max-age=30"}
 
 # WebSocket connection manager
-manager = ConnectionManager()
+manager = ConnectionManager(REDIS_URL)
 
 # Set connection manager for tourist and guide routers
 from routers.tourist import set_connection_manager as set_tourist_manager
@@ -44,33 +62,28 @@ app.include_router(guide_router)
 app.include_router(guide_auth_router)
 
 # Legacy routes that need to be maintained for backwards compatibility
+LEGACY_DASHBOARD_FIELDS = (
+    "id", "user_name", "blockchain_id", "last_lat", "last_lon",
+    "status", "tourist_destination_id", "tourist_destination_name"
+)
+
 @app.get("/dashboard")
 async def get_dashboard_data_legacy(
+    status_filter: Optional[str] = Query(None, alias="status"),
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
     db: AsyncSession = Depends(get_db)
 ):
     """Legacy dashboard endpoint - returns active trip data for backwards compatibility"""
-    result = await db.execute(select(Trip).filter(Trip.is_active == True))
-    trips = result.scalars().all()
-    trip_data = []
-    for trip in trips:
-        user_result = await db.execute(select(User).filter(User.id == trip.user_id))
-        user = user_result.scalar_one_or_none()
-        trip_data.append({
-            "id": trip.id,
-            "user_name": user.full_name if user else "Unknown",
-            "blockchain_id": trip.blockchain_id,
-            "last_lat": trip.last_lat,
-            "last_lon": trip.last_lon,
-            "status": trip.status,
-            "tourist_destination_id": trip.tourist_destination_id,
-            "tourist_destination_name": get_tourist_place_by_id(int(str(trip.tourist_destination_id)))["name"]
-        })
-    return trip_data
+    # Rows are encoded and sent as the cursor yields them instead of building the whole list first;
+    # without query parameters every active trip is returned, as before
+    rows = stream_active_trip_rows(db, LEGACY_DASHBOARD_FIELDS, status=status_filter, skip=skip, limit=limit)
+    return StreamingResponse(stream_json_array(rows), media_type="application/json")
 
 @app.get("/tourist-places")
-async def get_tourist_places_legacy():
+async def get_tourist_places_legacy(request: Request):
     """Legacy tourist places endpoint - redirect to admin router"""
-    return INDIAN_TOURIST_PLACES
+    return await get_tourist_places(request)
 
 @app.post("/update_location")
 async def update_location_legacy(
@@ -79,7 +92,6 @@ async def update_location_legacy(
     db: AsyncSession = Depends(get_db)
 ):
     """Legacy location update endpoint - redirect to tourist router"""
-    from routers.tourist import update_location
     return await update_location(location_data, current_user, db)
 
 @app.get("/map/{tourist_id}")
@@ -89,7 +101,6 @@ async def get_map_data_legacy(
     db: AsyncSession = Depends(get_db)
 ):
     """Legacy map data endpoint - redirect to tourist router"""
-    from routers.tourist import get_map_data
     return await get_map_data(tourist_id, current_user, db)
 
 
@@ -105,47 +116,29 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
     }
 
 @app.websocket("/ws/location")
-async def websocket_endpoint(websocket: WebSocket, db: AsyncSession = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for live location updates with authentication"""
     try:
         # Origin validation to prevent Cross-Site WebSocket Hijacking (CSWSH)
         origin = websocket.headers.get("origin")
         host = websocket.headers.get('host', 'localhost:5000')
-        allowed_origins = get_allowed_origins(host)
         
-        if origin and origin not in allowed_origins:
+        if origin and not is_allowed_origin(origin, host):
             await websocket.close(code=1008, reason="Origin not allowed")
             return
         
-        # Authenticate user using HttpOnly cookie
-        user = None
-        access_token = websocket.cookies.get("access_token")
-        
-        if access_token:
-            try:
-                payload = verify_token(access_token)
-                email = payload.get("sub")
-                if email:
-                    result = await db.execute(select(User).filter(User.email == email))
-                    user = result.scalar_one_or_none()
-            except HTTPException:
-                pass
-        
-        if not user:
-            await websocket.close(code=1008, reason="Authentication required")
-            return
-        
-        # Get active trip data if user is a tourist
-        trip = None
-        assigned_trip_ids = []
-        
-        if str(user.role) == "tourist":
-            result = await db.execute(select(Trip).filter(Trip.user_id == user.id, Trip.is_active == True))
-            trip = result.scalar_one_or_none()
-        elif str(user.role) == "guide":
-            # For guides, load all trips they are assigned to
-            result = await db.execute(select(Trip.id).filter(Trip.guide_id == user.id, Trip.is_active == True))
-            assigned_trip_ids = [int(str(trip_id)) for trip_id in result.scalars().all()]
+        # The database is only needed for the handshake; the session (and its pooled connection)
+        # is released before the long-lived receive loop
+        async with AsyncSessionLocal() as db:
+            # Authenticate user using HttpOnly cookie
+            user = await get_user_from_cookie_token(websocket.cookies.get("access_token"), db)
+            
+            if not user:
+                await websocket.close(code=1008, reason="Authentication required")
+                return
+            
+            # Active trip for tourists, assigned trip IDs for guides (cached across reconnects)
+            trip, assigned_trip_ids = await get_ws_context(db, user)
         
         # Connect with authenticated user
         await manager.connect(websocket, user, trip, assigned_trip_ids)
@@ -156,6 +149,9 @@ async def websocket_endpoint(websocket: WebSocket, db: AsyncSession = Depends(ge
                 data = await websocket.receive_text()
                 # Optional: Handle any client messages here if needed
         except WebSocketDisconnect:
+            pass
+        finally:
+            # Any exit from the receive loop (including errors handled below) unregisters the connection
             manager.disconnect(websocket)
     except Exception as e:
         # Log error and close connection
@@ -169,6 +165,8 @@ async def websocket_endpoint(websocket: WebSocket, db: AsyncSession = Depends(ge
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request, error: Optional[str] = None, message: Optional[str] = None):
     """Login page for both admin and tourist users"""
+    if not error and not message:
+        return HTMLResponse(LOGIN_PAGE_HTML, headers=STATIC_PAGE_HEADERS)
     return templates.TemplateResponse("login.html", {
         "request": request,
         "error": error,
@@ -178,6 +176,8 @@ async def login_page(request: Request, error: Optional[str] = None, message: Opt
 @app.get("/register-form", response_class=HTMLResponse)
 async def register_page(request: Request, error: Optional[str] = None):
     """Registration page for tourists"""
+    if not error:
+        return HTMLResponse(REGISTER_PAGE_HTML, headers=STATIC_PAGE_HEADERS)
     return templates.TemplateResponse("register.html", {
         "request": request,
         "error": error
@@ -193,7 +193,7 @@ async def tourist_dashboard_page(request: Request, message: Optional[str] = None
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
-    if str(current_user.role) != "tourist":
+    if current_user.role is not Role.TOURIST:
         return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
     
     # Get all trips for this user (both active and past)
@@ -206,7 +206,7 @@ async def tourist_dashboard_page(request: Request, message: Optional[str] = None
     assigned_guide = None
     
     for trip in all_trips:
-        tourist_place = get_tourist_place_by_id(int(str(trip.tourist_destination_id)))
+        tourist_place = get_tourist_place_by_id(trip.tourist_destination_id)
         trip_data = {
             "id": trip.id,
             "blockchain_id": trip.blockchain_id,
@@ -230,13 +230,10 @@ async def tourist_dashboard_page(request: Request, message: Optional[str] = None
             # Get guide information for active trip
             if trip.guide_id:
                 # Fetch guide user info
-                guide_result = await db.execute(select(User).filter(User.id == trip.guide_id))
-                guide_user = guide_result.scalar_one_or_none()
+                guide_user = await db.get(User, trip.guide_id)
                 
                 if guide_user:
                     # Get guide's latest location
-                    from models import GuideLocation
-                    from sqlalchemy import desc
                     guide_location_result = await db.execute(
                         select(GuideLocation)
                         .filter(GuideLocation.guide_id == guide_user.id)
@@ -246,7 +243,6 @@ async def tourist_dashboard_page(request: Request, message: Optional[str] = None
                     guide_location = guide_location_result.scalar_one_or_none()
                     
                     # Determine guide GPS status
-                    from datetime import datetime, timedelta
                     guide_gps_working = False
                     guide_status = "no_location"
                     
@@ -270,15 +266,7 @@ async def tourist_dashboard_page(request: Request, message: Optional[str] = None
             past_trips.append(trip_data)
     
     # Set up geofence data for active trip, or default to first tourist place
-    geofence_data = {"center_lat": 28.6129, "center_lon": 77.2295, "radius": 400, "name": "Default Location"}
-    if active_trip:
-        tourist_place = get_tourist_place_by_id(int(str(active_trip["tourist_destination_id"])))
-        geofence_data = {
-            "center_lat": tourist_place["lat"],
-            "center_lon": tourist_place["lon"],
-            "radius": tourist_place["radius"],
-            "name": tourist_place["name"]
-        }
+    geofence_data = get_geofence_by_id(active_trip["tourist_destination_id"]) if active_trip else DEFAULT_GEOFENCE
     
     return templates.TemplateResponse("tourist_dashboard.html", {
         "request": request,
@@ -286,7 +274,6 @@ async def tourist_dashboard_page(request: Request, message: Optional[str] = None
         "active_trip": active_trip,
         "past_trips": past_trips,
         "assigned_guide": assigned_guide,
-        "tourist_places": INDIAN_TOURIST_PLACES,
         "geofence": geofence_data,
         "message": message,
         "error": error
@@ -302,11 +289,11 @@ async def create_trip_page(request: Request, db: AsyncSession = Depends(get_db))
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
-    if str(current_user.role) != "tourist":
+    if current_user.role is not Role.TOURIST:
         return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
     
     # Check if user already has an active trip
-    result = await db.execute(select(Trip).filter(Trip.user_id == current_user.id, Trip.is_active == True))
+    result = await db.execute(ACTIVE_TRIP_BY_USER, {"user_id": current_user.id})
     active_trip = result.scalar_one_or_none()
     if active_trip:
         return RedirectResponse(url="/tourist-dashboard?message=You already have an active trip", status_code=status.HTTP_302_FOUND)
@@ -314,7 +301,7 @@ async def create_trip_page(request: Request, db: AsyncSession = Depends(get_db))
     return templates.TemplateResponse("create_trip.html", {
         "request": request,
         "user": current_user,
-        "tourist_places": INDIAN_TOURIST_PLACES
+        "tourist_place_options": TOURIST_PLACE_OPTIONS_HTML
     })
 
 @app.post("/create-trip")
@@ -335,20 +322,20 @@ async def create_trip_submit(
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
-    if str(current_user.role) != "tourist":
+    if current_user.role is not Role.TOURIST:
         return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
     
+    if tourist_destination_id not in VALID_LOCATION_IDS:
+        return templates.TemplateResponse("create_trip.html", {
+            "request": request,
+            "user": current_user,
+            "tourist_place_options": TOURIST_PLACE_OPTIONS_HTML,
+            "error": "Please select a valid tourist destination"
+        })
+    
     try:
-        # Store user data before session operations to avoid detachment issues
-        user_id = current_user.id
-        user_full_name = current_user.full_name
-        user_email = current_user.email
-        user_contact_number = current_user.contact_number
-        user_age = current_user.age
-        user_gender = current_user.gender
-        
         # Check if user already has an active trip
-        result = await db.execute(select(Trip).filter(Trip.user_id == user_id, Trip.is_active == True))
+        result = await db.execute(ACTIVE_TRIP_BY_USER, {"user_id": current_user.id})
         active_trip = result.scalar_one_or_none()
         if active_trip:
             return RedirectResponse(url="/tourist-dashboard?error=You already have an active trip", status_code=status.HTTP_302_FOUND)
@@ -356,7 +343,7 @@ async def create_trip_submit(
         # Find guide if email is provided
         guide_id = None
         if guide_email and guide_email.strip():
-            guide_result = await db.execute(select(User).filter(User.email == guide_email.strip(), User.role == "guide"))
+            guide_result = await db.execute(select(User).filter(User.email == guide_email.strip(), User.role == Role.GUIDE))
             guide_user = guide_result.scalar_one_or_none()
             if guide_user:
                 guide_id = guide_user.id
@@ -365,16 +352,16 @@ async def create_trip_submit(
                 return templates.TemplateResponse("create_trip.html", {
                     "request": request,
                     "user": current_user,
-                    "tourist_places": INDIAN_TOURIST_PLACES,
+                    "tourist_place_options": TOURIST_PLACE_OPTIONS_HTML,
                     "error": f"Guide with email '{guide_email}' not found or is not a guide role"
                 })
         
         # Create the new trip
         tourist_place = get_tourist_place_by_id(tourist_destination_id)
-        blockchain_id = Trip.generate_blockchain_id(str(user_full_name), tourist_place["name"])
+        blockchain_id = Trip.generate_blockchain_id(current_user.full_name, tourist_place["name"])
         
         new_trip = Trip(
-            user_id=user_id,
+            user_id=current_user.id,
             guide_id=guide_id,
             blockchain_id=blockchain_id,
             starting_location=starting_location,
@@ -386,24 +373,23 @@ async def create_trip_submit(
         )
         
         db.add(new_trip)
-        await db.commit()
-        await db.refresh(new_trip)
-        
-        # Store trip data after commit to avoid detachment issues
+        # Flush assigns the trip ID so it can be read before the single commit
+        await db.flush()
         trip_id = new_trip.id
+        await db.commit()
+        await manager.invalidate_ws_context(current_user.id, guide_id)
         
         # Notify admin dashboard about tourist becoming active
-        tourist_place = get_tourist_place_by_id(tourist_destination_id)
         trip_start_message = {
             "type": "tourist_status_change",
             "action": "trip_started",
-            "tourist_id": user_id,
+            "tourist_id": current_user.id,
             "trip_id": trip_id,
-            "name": user_full_name,
-            "email": user_email,
-            "contact_number": user_contact_number,
-            "age": user_age,
-            "gender": user_gender,
+            "name": current_user.full_name,
+            "email": current_user.email,
+            "contact_number": current_user.contact_number,
+            "age": current_user.age,
+            "gender": current_user.gender,
             "blockchain_id": blockchain_id,
             "starting_location": starting_location,
             "last_lat": tourist_place["lat"],
@@ -414,7 +400,7 @@ async def create_trip_submit(
             "hotels": hotels,
             "mode_of_travel": mode_of_travel
         }
-        await manager.broadcast_to_admins(json.dumps(trip_start_message))
+        await manager.broadcast_to_admins(encode_message(trip_start_message))
         
         # Redirect to dashboard with success message
         return RedirectResponse(url="/tourist-dashboard?message=Trip created successfully!", status_code=status.HTTP_302_FOUND)
@@ -424,7 +410,7 @@ async def create_trip_submit(
         return templates.TemplateResponse("create_trip.html", {
             "request": request,
             "user": current_user,
-            "tourist_places": INDIAN_TOURIST_PLACES,
+            "tourist_place_options": TOURIST_PLACE_OPTIONS_HTML,
             "error": f"Error creating trip: {str(e)}"
         })
 
@@ -442,7 +428,7 @@ async def close_trip(
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
-    if str(current_user.role) != "tourist":
+    if current_user.role is not Role.TOURIST:
         return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
     
     try:
@@ -459,18 +445,7 @@ async def close_trip(
         if not trip:
             return RedirectResponse(url="/tourist-dashboard?error=Trip not found or already closed", status_code=status.HTTP_302_FOUND)
         
-        # Store user data before session operations to avoid detachment issues
-        user_id = current_user.id
-        user_full_name = current_user.full_name
-        user_email = current_user.email
-        user_contact_number = current_user.contact_number
-        user_age = current_user.age
-        user_gender = current_user.gender
-        
         # Close the trip using SQLAlchemy update
-        from datetime import datetime
-        from sqlalchemy import update
-        
         await db.execute(
             update(Trip)
             .where(Trip.id == trip_id)
@@ -478,20 +453,21 @@ async def close_trip(
         )
         
         await db.commit()
+        await manager.invalidate_ws_context(current_user.id, trip.guide_id)
         
         # Notify admin dashboard about tourist becoming inactive
         trip_end_message = {
             "type": "tourist_status_change",
             "action": "trip_ended",
-            "tourist_id": user_id,
+            "tourist_id": current_user.id,
             "trip_id": trip_id,
-            "name": user_full_name,
-            "email": user_email,
-            "contact_number": user_contact_number,
-            "age": user_age,
-            "gender": user_gender
+            "name": current_user.full_name,
+            "email": current_user.email,
+            "contact_number": current_user.contact_number,
+            "age": current_user.age,
+            "gender": current_user.gender
         }
-        await manager.broadcast_to_admins(json.dumps(trip_end_message))
+        await manager.broadcast_to_admins(encode_message(trip_end_message))
         
         # Redirect to dashboard with success message
         return RedirectResponse(url="/tourist-dashboard?message=Trip closed successfully!", status_code=status.HTTP_302_FOUND)
@@ -511,91 +487,77 @@ async def dashboard_page(request: Request, db: AsyncSession = Depends(get_db)):
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
     # Check if user is admin
-    if str(current_user.role) != "admin":
-        if str(current_user.role) == "guide":
+    if current_user.role is not Role.ADMIN:
+        if current_user.role is Role.GUIDE:
             return RedirectResponse(url="/guide-dashboard", status_code=status.HTTP_302_FOUND)
         else:
             return RedirectResponse(url="/tourist-dashboard", status_code=status.HTTP_302_FOUND)
     
-    # Get all tourist users
-    tourists_result = await db.execute(select(User).filter(User.role == "tourist"))
-    all_tourists = tourists_result.scalars().all()
-    
-    # Get all active trips
-    active_trips_result = await db.execute(select(Trip).filter(Trip.is_active == True))
-    active_trips = active_trips_result.scalars().all()
-    
-    # Create mapping of user_id to active trip
-    user_to_active_trip = {}
-    for trip in active_trips:
-        user_to_active_trip[trip.user_id] = trip
-    
-    # Categorize tourists
-    active_tourists = []  # Tourists with active trips (for map)
-    inactive_tourists = []  # Tourists without active trips (for list)
-    
-    for tourist in all_tourists:
-        tourist_data = {
-            "id": tourist.id,
-            "name": tourist.full_name,
-            "email": tourist.email,
-            "contact_number": tourist.contact_number,
-            "age": tourist.age,
-            "gender": tourist.gender
+    # Get all tourist users with their active trip (if any) and its place name in one joined query;
+    # plain columns rather than ORM entities, so rows are read without hydrating User/Trip objects
+    tourists_result = await db.execute(
+        select(
+            User.id, User.full_name, User.email, User.contact_number, User.age, User.gender,
+            Trip.id.label("trip_id"), Trip.blockchain_id, Trip.starting_location, Trip.last_lat, Trip.last_lon,
+            Trip.status, Trip.tourist_destination_id, Trip.hotels, Trip.mode_of_travel
+        )
+        .outerjoin(Trip, and_(Trip.user_id == User.id, Trip.is_active == True))
+        .filter(User.role == Role.TOURIST)
+    )
+    tourist_rows = tourists_result.mappings().all()
+    
+    # Tourists with active trips (for map)
+    active_tourists = [
+        {
+            "id": row["id"],
+            "name": row["full_name"],
+            "email": row["email"],
+            "contact_number": row["contact_number"],
+            "age": row["age"],
+            "gender": row["gender"],
+            "trip_id": row["trip_id"],
+            "blockchain_id": row["blockchain_id"],
+            "starting_location": row["starting_location"],
+            "last_lat": row["last_lat"],
+            "last_lon": row["last_lon"],
+            "status": row["status"],
+            "tourist_destination_id": row["tourist_destination_id"],
+            "location_name": get_tourist_place_by_id(row["tourist_destination_id"])["name"],
+            "hotels": row["hotels"],
+            "mode_of_travel": row["mode_of_travel"],
+            "has_active_trip": True
         }
-        
-        if tourist.id in user_to_active_trip:
-            trip = user_to_active_trip[tourist.id]
-            tourist_place = get_tourist_place_by_id(int(str(trip.tourist_destination_id)))
-            
-            tourist_data.update({
-                "trip_id": trip.id,
-                "blockchain_id": trip.blockchain_id,
-                "starting_location": trip.starting_location,
-                "last_lat": trip.last_lat,
-                "last_lon": trip.last_lon,
-                "status": trip.status,
-                "tourist_destination_id": trip.tourist_destination_id,
-                "location_name": tourist_place["name"],
-                "hotels": trip.hotels,
-                "mode_of_travel": trip.mode_of_travel,
-                "has_active_trip": True
-            })
-            active_tourists.append(tourist_data)
-        else:
-            tourist_data.update({
-                "has_active_trip": False,
-                "status": "No Active Trip"
-            })
-            inactive_tourists.append(tourist_data)
+        for row in tourist_rows if row["trip_id"] is not None
+    ]
+    # Tourists without active trips (for list)
+    inactive_tourists = [
+        {
+            "id": row["id"],
+            "name": row["full_name"],
+            "email": row["email"],
+            "contact_number": row["contact_number"],
+            "age": row["age"],
+            "gender": row["gender"],
+            "has_active_trip": False,
+            "status": "No Active Trip"
+        }
+        for row in tourist_rows if row["trip_id"] is None
+    ]
     
     # Get all guides and their last known locations
-    from datetime import datetime, timedelta
-    from models import GuideLocation
-    from sqlalchemy import desc
-    
-    # Get all guide users
-    all_guides_result = await db.execute(select(User).filter(User.role == "guide"))
-    all_guides = all_guides_result.scalars().all()
+    # Guides with their location row (at most one per guide, it is updated in place)
+    all_guides_result = await db.execute(
+        select(User, GuideLocation)
+        .outerjoin(GuideLocation, GuideLocation.guide_id == User.id)
+        .filter(User.role == Role.GUIDE)
+    )
+    all_guides = all_guides_result.tuples().all()
+    assigned_counts = await count_active_trips_by_guide(db)
     
     active_guides = []
-    ten_minutes_ago = datetime.utcnow() - timedelta(minutes=10)
     
-    for guide_user in all_guides:
-        # Get the latest location for this guide
-        latest_location_result = await db.execute(
-            select(GuideLocation)
-            .filter(GuideLocation.guide_id == guide_user.id)
-            .order_by(desc(GuideLocation.updated_at))
-            .limit(1)
-        )
-        latest_location = latest_location_result.scalar_one_or_none()
-        
-        # Count assigned tourists for this guide
-        assigned_trips_result = await db.execute(
-            select(Trip).filter(Trip.guide_id == guide_user.id, Trip.is_active == True)
-        )
-        assigned_count = len(assigned_trips_result.scalars().all())
+    for guide_user, latest_location in all_guides:
+        assigned_count = assigned_counts.get(guide_user.id, 0)
         
         # Determine GPS status
         gps_working = False
@@ -655,12 +617,14 @@ async def guide_dashboard_page(request: Request, db: AsyncSession = Depends(get_
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
     # Check if user is guide
-    if str(current_user.role) != "guide":
+    if current_user.role is not Role.GUIDE:
         return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
     
     # Get all active trips assigned to this guide
     assigned_trips_result = await db.execute(
-        select(Trip).filter(Trip.guide_id == current_user.id, Trip.is_active == True)
+        select(Trip)
+        .options(joinedload(Trip.user))
+        .filter(Trip.guide_id == current_user.id, Trip.is_active == True)
     )
     assigned_trips = assigned_trips_result.scalars().all()
     
@@ -668,13 +632,9 @@ async def guide_dashboard_page(request: Request, db: AsyncSession = Depends(get_
     active_tourists = []
     
     for trip in assigned_trips:
-        # Get user data for the trip
-        user_result = await db.execute(select(User).filter(User.id == trip.user_id))
-        user = user_result.scalar_one_or_none()
+        user = trip.user
         
         if user:
-            tourist_place = get_tourist_place_by_id(int(str(trip.tourist_destination_id)))
-            
             tourist_data = {
                 "id": user.id,
                 "name": user.full_name,
@@ -689,7 +649,7 @@ async def guide_dashboard_page(request: Request, db: AsyncSession = Depends(get_
                 "last_lon": trip.last_lon,
                 "status": trip.status,
                 "tourist_destination_id": trip.tourist_destination_id,
-                "location_name": tourist_place["name"],
+                "location_name": get_tourist_place_by_id(trip.tourist_destination_id)["name"],
                 "hotels": trip.hotels,
                 "mode_of_travel": trip.mode_of_travel,
                 "has_active_trip": True
@@ -718,24 +678,19 @@ async def trip_map_page(
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
-    result = await db.execute(select(Trip).filter(Trip.id == trip_id))
-    trip = result.scalar_one_or_none()
+    trip = await db.get(Trip, trip_id)
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
     # Check if user has permission to view this trip's map
-    if str(current_user.role) == "tourist" and int(str(trip.user_id)) != current_user.id:
+    if current_user.role is Role.TOURIST and trip.user_id != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You can only view your own trip map"
         )
     
-    # Get the trip's destination geofence
-    tourist_place = get_tourist_place_by_id(int(str(trip.tourist_destination_id)))
-    
     # Get the tourist user data for the trip
-    tourist_result = await db.execute(select(User).filter(User.id == trip.user_id))
-    tourist_user = tourist_result.scalar_one_or_none()
+    tourist_user = await db.get(User, trip.user_id)
     if not tourist_user:
         raise HTTPException(status_code=404, detail="Tourist user not found")
     
@@ -753,12 +708,7 @@ async def trip_map_page(
         "trip": trip,
         "tourist": tourist,  # Pass tourist data to template
         "current_user": current_user,  # Pass current user to template
-        "geofence": {
-            "center_lat": tourist_place["lat"],
-            "center_lon": tourist_place["lon"],
-            "radius": tourist_place["radius"],
-            "name": tourist_place["name"]
-        }
+        "geofence": get_geofence_by_id(trip.tourist_destination_id)
     })
 
 # Startup event to create tables and demo users
@@ -766,8 +716,24 @@ async def trip_map_page(
 async def startup_event():
     """Initialize database on startup"""
     await create_tables()
-    await create_demo_users()
+    await sync_tourist_places()
+    if CREATE_DEMO_USERS:
+        await create_demo_users()
+    await manager.start_backplane()
+    start_location_writer()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush buffered positions and release the broadcast backplane connection"""
+    await stop_location_writer()
+    await manager.stop_backplane()
+    await close_redis()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    # "auto" picks uvloop/httptools when installed (uvicorn[standard]); workers need an import string
+    uvicorn.run(
+        "app:app", host="0.0.0.0", port=5000,
+        loop="auto", http="auto", ws="websockets", ws_max_size=65536,
+        workers=WEB_CONCURRENCY, backlog=2048
+    )
\ No newline at end of file
@@ -1,11 +1,19 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
+import asyncio
+import hashlib
+import time
+import orjson
+from cachetools import TTLCache
 from typing import Optional
 from fastapi import Depends, HTTPException, status, Cookie
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from models import User, get_db
+from sqlalchemy import select, bindparam
+from config import SESSION_CACHE_TTL
+from models import Role, User, get_db
+from redis_client import get_redis
 
 # JWT Configuration
 SECRET_KEY = "your-secret-key-change-this-in-production"  # In production, use environment variable
@@ -14,6 +22,9 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 security = HTTPBearer()
 
+# Login/registration lookup built once so every request reuses the cached compiled statement
+USER_BY_EMAIL = select(User).filter(User.email == bindparam("email"))
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -25,10 +36,19 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+@lru_cache(maxsize=1024)
+def _decode_token(token: str) -> dict:
+    """Check a token's signature once; repeat requests from the same session reuse the claims"""
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
 def verify_token(token: str):
     """Verify JWT token and return user data"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(token)
+        # Cached claims outlive the decode-time expiry check, so re-check it on every hit
+        exp = payload.get("exp")
+        if exp is not None and exp <= time.time():
+            raise JWTError("Signature has expired")
         email = payload.get("sub")
         if email is None or not isinstance(email, str):
             raise HTTPException(
@@ -44,6 +64,61 @@ def verify_token(token: str):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+# Session cache: verified token -> the user columns handlers read, so warm requests skip
+# the users query. The Redis layer is only active when REDIS_URL is configured; entries expire with the token.
+SESSION_CACHE_PREFIX = "sess:"
+SESSION_USER_FIELDS = ("id", "email", "full_name", "contact_number", "age", "gender", "role", "is_active")
+
+# In-process layer in front of Redis/DB; logout only clears it in this worker, so the TTL bounds staleness elsewhere
+_local_session_cache: TTLCache = TTLCache(maxsize=10_000, ttl=SESSION_CACHE_TTL)
+
+def _session_key(token: str) -> str:
+    return SESSION_CACHE_PREFIX + hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+async def get_user_for_token(token: str, payload: dict, db: AsyncSession) -> Optional[User]:
+    """Resolve the user of an already verified token, via the session cache when available"""
+    # Detached Users are built fresh from the cached columns on every hit; nothing is lazy-loaded from them
+    fields = _local_session_cache.get(token)
+    if fields is not None:
+        return User(**fields)
+    
+    redis = get_redis()
+    if redis is not None:
+        try:
+            cached = await redis.get(_session_key(token))
+            if cached is not None:
+                fields = orjson.loads(cached)
+                fields["role"] = Role(fields["role"])
+                _local_session_cache[token] = fields
+                return User(**fields)
+        except Exception as e:
+            print(f"Session cache read failed: {e}")
+    
+    result = await db.execute(USER_BY_EMAIL, {"email": payload["sub"]})
+    user = result.scalar_one_or_none()
+    
+    ttl = int(payload.get("exp", 0) - time.time())
+    if user is not None and ttl > 0:
+        fields = {field: getattr(user, field) for field in SESSION_USER_FIELDS}
+        _local_session_cache[token] = fields
+        if redis is not None:
+            try:
+                await redis.set(_session_key(token), orjson.dumps(fields), ex=ttl)
+            except Exception as e:
+                print(f"Session cache write failed: {e}")
+    return user
+
+async def invalidate_session(token: Optional[str]):
+    """Drop a token's cached session (on logout)"""
+    if token:
+        _local_session_cache.pop(token, None)
+    redis = get_redis()
+    if redis is not None and token:
+        try:
+            await redis.delete(_session_key(token))
+        except Exception as e:
+            print(f"Session cache delete failed: {e}")
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: AsyncSession = Depends(get_db)
@@ -59,8 +134,7 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    result = await db.execute(select(User).filter(User.email == email))
-    user = result.scalar_one_or_none()
+    user = await get_user_for_token(token, payload, db)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -88,8 +162,7 @@ async def get_current_user_from_cookie(
             detail="Invalid token: missing email"
         )
     
-    result = await db.execute(select(User).filter(User.email == email))
-    user = result.scalar_one_or_none()
+    user = await get_user_for_token(access_token, payload, db)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -105,7 +178,7 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
 
 async def require_admin(current_user: User = Depends(get_current_active_user)):
     """Require admin role"""
-    if str(current_user.role) != "admin":
+    if current_user.role is not Role.ADMIN:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required"
@@ -114,7 +187,7 @@ async def require_admin(current_user: User = Depends(get_current_active_user)):
 
 async def require_tourist(current_user: User = Depends(get_current_active_user)):
     """Require tourist role"""
-    if str(current_user.role) != "tourist":
+    if current_user.role is not Role.TOURIST:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Tourist access required"
@@ -123,7 +196,7 @@ async def require_tourist(current_user: User = Depends(get_current_active_user))
 
 async def require_guide(current_user: User = Depends(get_current_active_user)):
     """Require guide role"""
-    if str(current_user.role) != "guide":
+    if current_user.role is not Role.GUIDE:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Guide access required"
@@ -141,9 +214,7 @@ async def get_user_from_cookie_token(access_token: Optional[str], db: AsyncSessi
         if email is None or not isinstance(email, str):
             return None
         
-        result = await db.execute(select(User).filter(User.email == email))
-        user = result.scalar_one_or_none()
-        return user
+        return await get_user_for_token(access_token, payload, db)
     except HTTPException:
         return None
 
@@ -164,8 +235,7 @@ async def get_current_user_flexible(
             payload = verify_token(credentials.credentials)
             email = payload.get("sub")
             if email and isinstance(email, str):
-                result = await db.execute(select(User).filter(User.email == email))
-                user = result.scalar_one_or_none()
+                user = await get_user_for_token(credentials.credentials, payload, db)
         except HTTPException:
             # Bearer token authentication failed, will try cookie next
             pass
@@ -176,8 +246,7 @@ async def get_current_user_flexible(
             payload = verify_token(access_token)
             email = payload.get("sub")
             if email and isinstance(email, str):
-                result = await db.execute(select(User).filter(User.email == email))
-                user = result.scalar_one_or_none()
+                user = await get_user_for_token(access_token, payload, db)
         except HTTPException:
             # Cookie authentication also failed
             pass
@@ -200,7 +269,7 @@ async def get_current_active_user_flexible(current_user: User = Depends(get_curr
 
 async def require_guide_flexible(current_user: User = Depends(get_current_active_user_flexible)):
     """Require guide role with flexible authentication (Bearer token or cookie)"""
-    if str(current_user.role) != "guide":
+    if current_user.role is not Role.GUIDE:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Guide access required"
@@ -209,10 +278,11 @@ async def require_guide_flexible(current_user: User = Depends(get_current_active
 
 async def authenticate_user(email: str, password: str, db: AsyncSession) -> Optional[User]:
     """Authenticate user with email and password"""
-    result = await db.execute(select(User).filter(User.email == email))
+    result = await db.execute(USER_BY_EMAIL, {"email": email})
     user = result.scalar_one_or_none()
     if not user:
         return None
-    if not user.verify_password(password):
+    # Key derivation is CPU-bound; keep it off the event loop
+    if not await asyncio.to_thread(user.verify_password, password):
         return None
     return user
\ No newline at end of file
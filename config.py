@@ -1,7 +1,12 @@
 # Configuration settings for the Tourist Safety Monitoring System
 
-# Indian Tourist Places Configuration
-INDIAN_TOURIST_PLACES = [
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Indian Tourist Places Configuration (immutable, shared by every request)
+INDIAN_TOURIST_PLACES = (
     {"id": 1, "name": "Taj Mahal, Agra", "lat": 27.1751, "lon": 78.0421, "radius": 500},
     {"id": 2, "name": "Red Fort, Delhi", "lat": 28.6562, "lon": 77.2410, "radius": 400},
     {"id": 3, "name": "Gateway of India, Mumbai", "lat": 18.9220, "lon": 72.8347, "radius": 300},
@@ -9,18 +14,49 @@ INDIAN_TOURIST_PLACES = [
     {"id": 5, "name": "Golden Temple, Amritsar", "lat": 31.6200, "lon": 74.8765, "radius": 400},
     {"id": 6, "name": "India Gate, New Delhi", "lat": 28.6129, "lon": 77.2295, "radius": 400},
     {"id": 7, "name": "Mysore Palace, Mysore", "lat": 12.3051, "lon": 76.6551, "radius": 400}
-]
+)
 
 # Default geofence (Taj Mahal for backwards compatibility)
 GEOFENCE_CENTER = {"lat": 27.1751, "lon": 78.0421}
 GEOFENCE_RADIUS = 500
 
 # WebSocket allowed origins
-def get_allowed_origins(host: str) -> list[str]:
-    """Get allowed origins for WebSocket connections"""
-    return [
-        f"http://{host}",
-        f"https://{host}",
-        "http://localhost:5000",
-        "https://localhost:5000"
-    ]
\ No newline at end of file
+STATIC_ALLOWED_ORIGINS = frozenset({"http://localhost:5000", "https://localhost:5000"})
+
+def is_allowed_origin(origin: str, host: str) -> bool:
+    """Allow the request host over http/https plus the local development origins"""
+    if origin in STATIC_ALLOWED_ORIGINS:
+        return True
+    scheme, _, origin_host = origin.partition("://")
+    return origin_host == host and (scheme == "http" or scheme == "https")
+
+# WebSocket broadcast batching (each flush is a single frame, i.e. a single socket write)
+WS_FLUSH_INTERVAL = float(os.environ.get("WS_FLUSH_INTERVAL", "0.025"))  # seconds to let a burst accumulate; 0 sends as soon as drained
+WS_FLUSH_BYTES = int(os.environ.get("WS_FLUSH_BYTES", "1024"))  # flush immediately once the pending batch reaches this size
+WS_OUTBOX_MAX_SIZE = int(os.environ.get("WS_OUTBOX_MAX_SIZE", "256"))  # oldest messages are dropped when a slow client falls this far behind
+WS_DUPLICATE_WINDOW = float(os.environ.get("WS_DUPLICATE_WINDOW", "5"))  # seconds an unchanged location update is suppressed for
+WS_FANOUT_BATCH = int(os.environ.get("WS_FANOUT_BATCH", "50"))  # recipients enqueued per event-loop turn before yielding to other tasks
+WS_DUPLICATE_CACHE_SIZE = 1024  # trips whose last broadcast position is remembered
+GUIDE_POSITIONS_CACHE_TTL = 2  # seconds the encoded admin guide-position list is reused between guide updates
+TRIP_CONTEXT_CACHE_TTL = 300  # seconds a trip's fixed fields (owner, guide, destination) are reused by location updates
+SESSION_CACHE_TTL = 60  # seconds a token's user columns are reused in-process before Redis/DB is asked again
+WS_CONTEXT_CACHE_TTL = 60  # seconds a user's WebSocket routing context (trip / assigned trips) is reused across reconnects
+
+# Trip position write batching: 0 commits every location update in its request; a positive value buffers
+# positions for that many seconds and writes them with one bulk UPDATE (broadcasts are still sent immediately)
+LOCATION_BATCH_INTERVAL = float(os.environ.get("LOCATION_BATCH_INTERVAL", "0"))
+LOCATION_BATCH_MAX_SIZE = int(os.environ.get("LOCATION_BATCH_MAX_SIZE", "500"))  # trips per bulk UPDATE statement
+
+# Seed the demo accounts advertised on the login page at startup; set to false in production to skip the upsert
+CREATE_DEMO_USERS = os.environ.get("CREATE_DEMO_USERS", "True").lower() == "true"
+
+# Optional Redis pub/sub backplane so broadcasts reach connections on every worker
+REDIS_URL = os.environ.get("REDIS_URL")  # e.g. redis://localhost:6379/0; unset keeps broadcasts in-process
+BACKPLANE_RETRY_MIN = 0.5  # seconds before the first resubscribe after the relay loses Redis
+BACKPLANE_RETRY_MAX = 30.0  # cap for the doubling resubscribe delay
+
+# Server workers: one unless WEB_CONCURRENCY is set. Broadcasts only cross processes through the Redis
+# backplane, so only raise it together with REDIS_URL. Each worker has its own DB pool of up to
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections (20 + 40 by default), so keep
+# WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW) below Postgres max_connections (100 by default)
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
@@ -8,7 +8,7 @@ import asyncio
 import sys
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from models import User, Trip, AsyncSessionLocal
+from models import Role, User, Trip, AsyncSessionLocal
 import hashlib
 
 async def create_comprehensive_test_data():
@@ -17,11 +17,22 @@ async def create_comprehensive_test_data():
         try:
             print("🔧 Creating comprehensive test data for location tracking tests...")
             
-            # Create test guide
             test_guide_email = "testguide@demo.com"
-            result = await db.execute(select(User).filter(User.email == test_guide_email))
-            test_guide = result.scalar_one_or_none()
+            test_tourist_email = "testtourist@demo.com" 
             
+            # Additional test tourists for comprehensive testing
+            additional_tourists = [
+                ("tourist2@demo.com", "Test Tourist 2", "+1234567895", 28, "M"),
+                ("tourist3@demo.com", "Test Tourist 3", "+1234567896", 22, "F"),
+            ]
+            
+            # Look up every seeded account in one query
+            emails = [test_guide_email, test_tourist_email] + [email for email, *_ in additional_tourists]
+            result = await db.execute(select(User).where(User.email.in_(emails)))
+            existing = {user.email: user for user in result.scalars()}
+            
+            # Create test guide
+            test_guide = existing.get(test_guide_email)
             if not test_guide:
                 test_guide = User(
                     email=test_guide_email,
@@ -30,20 +41,15 @@ async def create_comprehensive_test_data():
                     contact_number="+1234567893",
                     age=30,
                     gender="M",
-                    role="guide"
+                    role=Role.GUIDE
                 )
                 db.add(test_guide)
-                await db.commit()
-                await db.refresh(test_guide)
                 print(f"✅ Created test guide: {test_guide_email}")
             else:
                 print(f"✅ Test guide already exists: {test_guide_email}")
             
             # Create test tourist
-            test_tourist_email = "testtourist@demo.com" 
-            result = await db.execute(select(User).filter(User.email == test_tourist_email))
-            test_tourist = result.scalar_one_or_none()
-            
+            test_tourist = existing.get(test_tourist_email)
             if not test_tourist:
                 test_tourist = User(
                     email=test_tourist_email,
@@ -52,15 +58,31 @@ async def create_comprehensive_test_data():
                     contact_number="+1234567894",
                     age=25,
                     gender="F",
-                    role="tourist"
+                    role=Role.TOURIST
                 )
                 db.add(test_tourist)
-                await db.commit()
-                await db.refresh(test_tourist)
                 print(f"✅ Created test tourist: {test_tourist_email}")
             else:
                 print(f"✅ Test tourist already exists: {test_tourist_email}")
             
+            new_tourists = []
+            for email, name, contact, age, gender in additional_tourists:
+                if email not in existing:
+                    new_tourist = User(
+                        email=email,
+                        hashed_password=User.get_password_hash("tourist123"),
+                        full_name=name,
+                        contact_number=contact,
+                        age=age,
+                        gender=gender,
+                        role=Role.TOURIST
+                    )
+                    new_tourists.append(new_tourist)
+            db.add_all(new_tourists)
+            
+            # Flush assigns IDs to the new users without committing
+            await db.flush()
+            
             # Create test trip with guide assignment
             result = await db.execute(
                 select(Trip).filter(
@@ -89,62 +111,38 @@ async def create_comprehensive_test_data():
                     is_active=True
                 )
                 db.add(test_trip)
-                await db.commit()
-                await db.refresh(test_trip)
+                await db.flush()
                 print(f"✅ Created test trip with guide assignment: Trip ID {test_trip.id}")
             else:
                 # Update existing trip to have guide assignment
                 existing_trip.guide_id = test_guide.id
-                await db.commit()
                 print(f"✅ Updated existing trip with guide assignment: Trip ID {existing_trip.id}")
             
-            # Create additional test tourists for comprehensive testing
-            additional_tourists = [
-                ("tourist2@demo.com", "Test Tourist 2", "+1234567895", 28, "M"),
-                ("tourist3@demo.com", "Test Tourist 3", "+1234567896", 22, "F"),
-            ]
-            
-            for email, name, contact, age, gender in additional_tourists:
-                result = await db.execute(select(User).filter(User.email == email))
-                existing_user = result.scalar_one_or_none()
+            for new_tourist in new_tourists:
+                # Create trip for this tourist (some with guide, some without)
+                blockchain_data = f"{new_tourist.full_name}_{new_tourist.email}_trip"
+                blockchain_id = hashlib.sha256(blockchain_data.encode()).hexdigest()[:16]
                 
-                if not existing_user:
-                    new_tourist = User(
-                        email=email,
-                        hashed_password=User.get_password_hash("tourist123"),
-                        full_name=name,
-                        contact_number=contact,
-                        age=age,
-                        gender=gender,
-                        role="tourist"
-                    )
-                    db.add(new_tourist)
-                    await db.commit()
-                    await db.refresh(new_tourist)
-                    
-                    # Create trip for this tourist (some with guide, some without)
-                    blockchain_data = f"{name}_{email}_trip"
-                    blockchain_id = hashlib.sha256(blockchain_data.encode()).hexdigest()[:16]
-                    
-                    # Assign guide to tourist2 only
-                    guide_assignment = test_guide.id if "tourist2" in email else None
-                    
-                    new_trip = Trip(
-                        user_id=new_tourist.id,
-                        guide_id=guide_assignment,
-                        blockchain_id=blockchain_id,
-                        starting_location="Mumbai Central Station",
-                        tourist_destination_id=2,  # Red Fort
-                        last_lat=28.6562,  # Red Fort coordinates  
-                        last_lon=77.2410,
-                        status="Safe",
-                        hotels='[{"name": "Mumbai Hotel", "address": "Mumbai Address"}]',
-                        mode_of_travel="flight",
-                        is_active=True
-                    )
-                    db.add(new_trip)
-                    print(f"✅ Created additional tourist and trip: {name}")
+                # Assign guide to tourist2 only
+                guide_assignment = test_guide.id if "tourist2" in new_tourist.email else None
+                
+                new_trip = Trip(
+                    user_id=new_tourist.id,
+                    guide_id=guide_assignment,
+                    blockchain_id=blockchain_id,
+                    starting_location="Mumbai Central Station",
+                    tourist_destination_id=2,  # Red Fort
+                    last_lat=28.6562,  # Red Fort coordinates  
+                    last_lon=77.2410,
+                    status="Safe",
+                    hotels='[{"name": "Mumbai Hotel", "address": "Mumbai Address"}]',
+                    mode_of_travel="flight",
+                    is_active=True
+                )
+                db.add(new_trip)
+                print(f"✅ Created additional tourist and trip: {new_tourist.full_name}")
             
+            # Everything above lands in a single transaction
             await db.commit()
             
             print("\n🎯 Test Data Summary:")
@@ -150,12 +150,10 @@ def test_coordinate_validation_schemas():
         # Test validation features
         validation_features = [
             ('class GuideLocationUpdate', 'Guide Location Update Schema'),
-            ('def validate_coordinates', 'Coordinate Validation Method'),
-            ('math.isnan', 'NaN Check'),
-            ('math.isinf', 'Infinity Check'),
-            ('-90 <= self.latitude <= 90', 'Latitude Range Check'),
-            ('-180 <= self.longitude <= 180', 'Longitude Range Check'),
-            ('ValueError', 'Error Handling'),
+            ('allow_inf_nan=False', 'NaN/Infinity Check'),
+            ('Field(ge=-90, le=90', 'Latitude Range Check'),
+            ('Field(ge=-180, le=180', 'Longitude Range Check'),
+            ('latitude: Latitude', 'Validated Coordinate Fields'),
         ]
         
         results = []
@@ -182,7 +180,7 @@ def test_guide_routes():
         route_features = [
             ('@router.post("/update_location")', 'Location Update Endpoint'),
             ('GuideLocationUpdate', 'Schema Usage'),
-            ('validate_coordinates()', 'Validation Call'),
+            ('location_data: GuideLocationUpdate', 'Validated Request Body'),
             ('WebSocket', 'WebSocket Integration'),
             ('require_guide', 'Guide Authentication'),
             ('GuideLocation', 'Database Model Usage'),
@@ -0,0 +1,109 @@
+# Batched trip position writes for the Tourist Safety Monitoring System
+
+import asyncio
+from typing import Dict, Optional
+from sqlalchemy import select, update, values, column, Integer, Float, String
+from models import Trip, Incident, AsyncSessionLocal
+from config import LOCATION_BATCH_INTERVAL, LOCATION_BATCH_MAX_SIZE
+
+class PendingPosition:
+    """Latest buffered position of one trip, plus what is needed to log its incidents at flush time"""
+    __slots__ = ("latitude", "longitude", "status", "first_status", "new_incidents")
+
+    def __init__(self, latitude: float, longitude: float, status: str):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.status = status
+        self.first_status = status  # compared with the stored status once the batch is written
+        self.new_incidents = 0  # Safe -> Critical transitions seen inside the batch window
+
+_pending: Dict[int, PendingPosition] = {}
+_writer_task: Optional[asyncio.Task] = None
+_stopping: Optional[asyncio.Event] = None
+
+def batching_enabled() -> bool:
+    """True when position writes are buffered instead of committed per request"""
+    return _writer_task is not None
+
+def queue_position(trip_id: int, latitude: float, longitude: float, status: str):
+    """Buffer a trip's new position; repeated updates inside one window collapse into a single row"""
+    pending = _pending.get(trip_id)
+    if pending is None:
+        _pending[trip_id] = PendingPosition(latitude, longitude, status)
+        return
+    if pending.status != "Critical" and status == "Critical":
+        pending.new_incidents += 1
+    pending.latitude = latitude
+    pending.longitude = longitude
+    pending.status = status
+
+def _bulk_position_update(rows: list):
+    """One UPDATE ... FROM (VALUES ...) for many trips, returning each trip's status before the write"""
+    positions = values(
+        column("id", Integer), column("lat", Float), column("lon", Float), column("status", String), name="positions"
+    ).data(rows)
+    # Rows are locked in id order so concurrent flushes from several workers cannot deadlock
+    previous = (
+        select(Trip.id, Trip.status)
+        .filter(Trip.id.in_([row[0] for row in rows]))
+        .order_by(Trip.id)
+        .with_for_update()
+        .subquery("previous")
+    )
+    return (
+        update(Trip)
+        .where(Trip.id == positions.c.id, Trip.id == previous.c.id)
+        .values(last_lat=positions.c.lat, last_lon=positions.c.lon, status=positions.c.status)
+        .returning(Trip.id, previous.c.status)
+        .execution_options(synchronize_session=False)
+    )
+
+async def flush_positions():
+    """Write every buffered position and the incidents they raise in a single transaction"""
+    global _pending
+    if not _pending:
+        return
+    batch, _pending = _pending, {}
+    items = sorted(batch.items())
+    try:
+        async with AsyncSessionLocal() as db:
+            for start in range(0, len(items), LOCATION_BATCH_MAX_SIZE):
+                chunk = items[start:start + LOCATION_BATCH_MAX_SIZE]
+                rows = [(trip_id, p.latitude, p.longitude, p.status) for trip_id, p in chunk]
+                result = await db.execute(_bulk_position_update(rows))
+                previous_status = dict(result.tuples().all())
+
+                for trip_id, p in chunk:
+                    if trip_id not in previous_status:
+                        continue  # trip deleted since the update was accepted
+                    incidents = p.new_incidents + (previous_status[trip_id] != "Critical" and p.first_status == "Critical")
+                    db.add_all(Incident(trip_id=trip_id, severity="Critical") for _ in range(incidents))
+            await db.commit()
+    except Exception as e:
+        print(f"Batched location write failed, dropped {len(items)} positions: {e}")
+
+async def _writer_loop(stopping: asyncio.Event):
+    """Flush the buffer every LOCATION_BATCH_INTERVAL seconds, and once more when asked to stop"""
+    while not stopping.is_set():
+        try:
+            await asyncio.wait_for(stopping.wait(), LOCATION_BATCH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        # Never cancelled mid-flush, so a batch taken off the buffer is always written
+        await flush_positions()
+
+def start_location_writer():
+    """Start the background flusher; does nothing unless LOCATION_BATCH_INTERVAL is set"""
+    global _writer_task, _stopping
+    if LOCATION_BATCH_INTERVAL > 0 and _writer_task is None:
+        _stopping = asyncio.Event()
+        _writer_task = asyncio.create_task(_writer_loop(_stopping))
+
+async def stop_location_writer():
+    """Stop the flusher after it writes whatever is still buffered"""
+    global _writer_task, _stopping
+    if _writer_task is not None:
+        _stopping.set()
+        await _writer_task
+        _writer_task = None
+        _stopping = None
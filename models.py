@@ -1,37 +1,51 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, MetaData, Table, Numeric, Index, Enum as SAEnum
+from sqlalchemy.types import UserDefinedType
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from datetime import datetime
+from typing import List, Optional
+import enum
 import hashlib
 from passlib.context import CryptContext
 
-Base = declarative_base()
+class Base(DeclarativeBase):
+    pass
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
+class Role(str, enum.Enum):
+    """User roles - compare with `is`; members still equal and render as their plain value"""
+    ADMIN = "admin"
+    TOURIST = "tourist"
+    GUIDE = "guide"
+
+    __str__ = str.__str__
+
 class User(Base):
     __tablename__ = "users"
     
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, unique=True, nullable=False, index=True)
-    hashed_password = Column(String, nullable=False)
-    full_name = Column(String, nullable=False)
-    contact_number = Column(String, nullable=False)
-    age = Column(Integer, nullable=False)
-    gender = Column(String, nullable=False)  # 'M' or 'F'
-    role = Column(String, nullable=False, default="tourist")  # admin or tourist
-    is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    email: Mapped[str] = mapped_column(String, unique=True, nullable=False, index=True)
+    hashed_password: Mapped[str] = mapped_column(String, nullable=False)
+    full_name: Mapped[str] = mapped_column(String, nullable=False)
+    contact_number: Mapped[str] = mapped_column(String, nullable=False)
+    age: Mapped[int] = mapped_column(Integer, nullable=False)
+    gender: Mapped[str] = mapped_column(String, nullable=False)  # 'M' or 'F'
+    role: Mapped[Role] = mapped_column(
+        SAEnum(Role, native_enum=False, values_callable=lambda roles: [role.value for role in roles]),
+        nullable=False, default=Role.TOURIST
+    )  # stored as the plain strings 'admin', 'tourist' or 'guide'
+    is_active: Mapped[Optional[bool]] = mapped_column(Boolean, default=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Relationship to trips (one-to-many)
-    trips = relationship("Trip", back_populates="user", foreign_keys="Trip.user_id")
-    guided_trips = relationship("Trip", foreign_keys="Trip.guide_id")
+    trips: Mapped[List["Trip"]] = relationship("Trip", back_populates="user", foreign_keys="Trip.user_id")
+    guided_trips: Mapped[List["Trip"]] = relationship("Trip", foreign_keys="Trip.guide_id")
     
     def verify_password(self, password: str) -> bool:
         """Verify password against hashed password"""
-        return pwd_context.verify(password, str(self.hashed_password))
+        return pwd_context.verify(password, self.hashed_password)
     
     @classmethod
     def get_password_hash(cls, password: str) -> str:
@@ -40,73 +54,102 @@ class User(Base):
 
 class Trip(Base):
     __tablename__ = "trips"
+    # Active-trip lookups filter by owner/guide together with is_active
+    __table_args__ = (
+        Index("ix_trips_user_id_is_active", "user_id", "is_active"),
+        Index("ix_trips_guide_id_is_active", "guide_id", "is_active"),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    guide_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # Optional guide assignment
-    blockchain_id = Column(String, unique=True, nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
+    guide_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("users.id"), nullable=True)  # Optional guide assignment
+    blockchain_id: Mapped[str] = mapped_column(String, unique=True, nullable=False)
     
     # Trip details
-    starting_location = Column(String, nullable=False)
-    tourist_destination_id = Column(Integer, nullable=False)  # ID of tourist place
-    hotels = Column(String, nullable=True)  # JSON string of hotel list
-    mode_of_travel = Column(String, nullable=False)  # car, train, bus, flight
+    starting_location: Mapped[str] = mapped_column(String, nullable=False)
+    tourist_destination_id: Mapped[int] = mapped_column(Integer, nullable=False)  # ID of tourist place
+    hotels: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # JSON string of hotel list
+    mode_of_travel: Mapped[str] = mapped_column(String, nullable=False)  # car, train, bus, flight
     
     # Current location tracking
-    last_lat = Column(Float, nullable=True)
-    last_lon = Column(Float, nullable=True)
-    status = Column(String, default="Safe")  # Safe or Critical
+    last_lat: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    last_lon: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    status: Mapped[Optional[str]] = mapped_column(String, default="Safe")  # Safe or Critical
     
     # Trip status
-    is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    closed_at = Column(DateTime, nullable=True)
+    is_active: Mapped[Optional[bool]] = mapped_column(Boolean, default=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    closed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     
     # Relationships
-    incidents = relationship("Incident", back_populates="trip")
-    user = relationship("User", back_populates="trips", foreign_keys=[user_id])
-    guide = relationship("User", foreign_keys=[guide_id], overlaps="guided_trips")
+    incidents: Mapped[List["Incident"]] = relationship("Incident", back_populates="trip")
+    user: Mapped["User"] = relationship("User", back_populates="trips", foreign_keys=[user_id])
+    guide: Mapped[Optional["User"]] = relationship("User", foreign_keys=[guide_id], overlaps="guided_trips")
     
     @classmethod
     def generate_blockchain_id(cls, user_name: str, destination: str) -> str:
-        """Generate a mock blockchain ID using SHA256 hash"""
-        return hashlib.sha256(f"{user_name}_{destination}_{datetime.now()}".encode()).hexdigest()
+        """Generate a mock blockchain ID using a BLAKE2b hash"""
+        # ~2us per call, so it runs inline; the 32-byte digest keeps IDs 64 hex chars as before
+        return hashlib.blake2b(f"{user_name}_{destination}_{datetime.now()}".encode(), digest_size=32).hexdigest()
 
 class Incident(Base):
     __tablename__ = "incidents"
     
-    id = Column(Integer, primary_key=True, index=True)
-    trip_id = Column(Integer, ForeignKey("trips.id"), nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    severity = Column(String, default="Critical")  # Low, Medium, High, Critical
-    incident_type = Column(String, default="Geofence")  # Geofence, SOS, Manual
-    status = Column(String, default="Open")  # Open, Acknowledged, Resolved
-    description = Column(String, nullable=True)  # Optional description
-    latitude = Column(Float, nullable=True)  # Location where incident occurred
-    longitude = Column(Float, nullable=True)
-    acknowledged_by = Column(String, nullable=True)  # Admin who acknowledged
-    acknowledged_at = Column(DateTime, nullable=True)
-    resolved_at = Column(DateTime, nullable=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    trip_id: Mapped[int] = mapped_column(Integer, ForeignKey("trips.id"), nullable=False)
+    timestamp: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    severity: Mapped[Optional[str]] = mapped_column(String, default="Critical")  # Low, Medium, High, Critical
+    incident_type: Mapped[Optional[str]] = mapped_column(String, default="Geofence")  # Geofence, SOS, Manual
+    status: Mapped[Optional[str]] = mapped_column(String, default="Open")  # Open, Acknowledged, Resolved
+    description: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # Optional description
+    latitude: Mapped[Optional[float]] = mapped_column(Float, nullable=True)  # Location where incident occurred
+    longitude: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    acknowledged_by: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # Admin who acknowledged
+    acknowledged_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    resolved_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     
     # Relationship to trip
-    trip = relationship("Trip", back_populates="incidents")
+    trip: Mapped["Trip"] = relationship("Trip", back_populates="incidents")
 
 class GuideLocation(Base):
     __tablename__ = "guide_locations"
+    # Serves the per-guide lookup ordered by most recent update
+    __table_args__ = (Index("ix_guide_locations_guide_id_updated_at", "guide_id", "updated_at"),)
     
-    id = Column(Integer, primary_key=True, index=True)
-    guide_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    latitude = Column(Float, nullable=False)
-    longitude = Column(Float, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    guide_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
+    latitude: Mapped[float] = mapped_column(Float, nullable=False)
+    longitude: Mapped[float] = mapped_column(Float, nullable=False)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Relationship to guide user
-    guide = relationship("User", foreign_keys=[guide_id])
+    guide: Mapped["User"] = relationship("User", foreign_keys=[guide_id])
     
     def __repr__(self):
         return f"<GuideLocation(guide_id={self.guide_id}, lat={self.latitude}, lon={self.longitude}, updated_at={self.updated_at})>"
 
+class Geography(UserDefinedType):
+    """PostGIS geography(Point, 4326) column type"""
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "geography(Point, 4326)"
+
+# PostGIS geofences live in their own metadata so plain PostgreSQL
+# deployments never try to create the geography column
+postgis_metadata = MetaData()
+
+tourist_places_table = Table(
+    "tourist_places",
+    postgis_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),  # IDs mirror INDIAN_TOURIST_PLACES
+    Column("name", String, nullable=False),
+    Column("center", Geography(), nullable=False),
+    Column("radius_m", Numeric, nullable=False),
+    Index("tourist_places_gix", "center", postgresql_using="gist"),
+)
+
 # Database configuration
 import os
 from dotenv import load_dotenv
@@ -122,9 +165,24 @@ if DATABASE_URL.startswith("postgresql://"):
 elif DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+asyncpg://", 1)
 
+# Opt-in: evaluate geofences in PostGIS (requires the postgis extension)
+USE_POSTGIS = os.environ.get("USE_POSTGIS", "False").lower() == "true"
+
 # Use echo=False in production to avoid logging sensitive data
-engine = create_async_engine(DATABASE_URL, echo=os.environ.get("DEBUG", "False").lower() == "true")
-AsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
+# Pool sized for many short handler queries; LIFO reuse keeps a small set of connections warm, and
+# connections are recycled on age instead of pinged on every checkout (one less round trip per request).
+# DB_POOL_PRE_PING=true restores the ping where a proxy or firewall drops idle connections sooner than that
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=os.environ.get("DEBUG", "False").lower() == "true",
+    pool_size=int(os.environ.get("DB_POOL_SIZE", "20")),
+    max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "40")),
+    pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", "1800")),
+    pool_pre_ping=os.environ.get("DB_POOL_PRE_PING", "False").lower() == "true",
+    pool_use_lifo=True
+)
+# expire_on_commit=False keeps loaded attributes usable after commit instead of reloading each row
+AsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine, class_=AsyncSession)
 
 async def get_db():
     """Database dependency for FastAPI"""
@@ -138,3 +196,9 @@ async def create_tables():
     """Create all tables in the database"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        # create_all skips tables that already exist, so indexes added to them later are created here (no-op once present)
+        for table in (Trip.__table__, GuideLocation.__table__):
+            for index in table.indexes:
+                await conn.run_sync(index.create, checkfirst=True)
+        if USE_POSTGIS:
+            await conn.run_sync(postgis_metadata.create_all)
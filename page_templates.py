@@ -0,0 +1,13 @@
+# Shared Jinja2 templates for the Tourist Safety Monitoring System pages
+
+import os
+from fastapi.templating import Jinja2Templates
+
+templates = Jinja2Templates(directory="templates")
+
+# Outside debug mode templates never change on disk, so cached templates are used without an mtime check per render
+templates.env.auto_reload = os.environ.get("DEBUG", "False").lower() == "true"
+
+# Compile every page once at import instead of on each worker's first request for it
+for _name in templates.env.list_templates():
+    templates.env.get_template(_name)
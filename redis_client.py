@@ -0,0 +1,20 @@
+# Shared Redis client for the Tourist Safety Monitoring System caches
+
+from config import REDIS_URL
+
+_client = None
+
+def get_redis():
+    """Return the shared Redis client, or None when REDIS_URL is not configured"""
+    global _client
+    if _client is None and REDIS_URL:
+        import redis.asyncio as aioredis  # only required when REDIS_URL is set
+        _client = aioredis.from_url(REDIS_URL)
+    return _client
+
+async def close_redis():
+    """Close the shared Redis client if one was opened"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
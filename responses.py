@@ -0,0 +1,11 @@
+# Response classes for the Tourist Safety Monitoring System
+
+from typing import Any
+import orjson
+from fastapi.responses import JSONResponse
+
+class OrjsonResponse(JSONResponse):
+    """JSON response rendered with orjson straight to bytes (FastAPI's ORJSONResponse is deprecated)"""
+    def render(self, content: Any) -> bytes:
+        # Non-string keys keep parity with the stdlib encoder for id-keyed dicts
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
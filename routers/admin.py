@@ -1,84 +1,48 @@
 # Admin routes for the Tourist Safety Monitoring System
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 from typing import List
 
-from models import User, Trip, GuideLocation, get_db
+from models import User, get_db
 from schemas import TripData
-from services import get_tourist_place_by_id
+from services import get_guide_positions_json, stream_active_trip_rows, TOURIST_PLACES_JSON, TOURIST_PLACES_ETAG
 from auth import require_admin
-from config import INDIAN_TOURIST_PLACES
-from datetime import datetime, timedelta
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
+DASHBOARD_TRIP_FIELDS = (
+    "id", "user_name", "blockchain_id", "starting_location", "last_lat", "last_lon", "status",
+    "tourist_destination_id", "tourist_destination_name", "hotels", "mode_of_travel", "is_active"
+)
+
 @router.get("/dashboard")
 async def get_dashboard_data(
     current_user: User = Depends(require_admin),
     db: AsyncSession = Depends(get_db)
 ):
     """Get all active trips and guide locations data for dashboard"""
-    # Get active tourist trips
-    result = await db.execute(select(Trip).filter(Trip.is_active == True))
-    trips = result.scalars().all()
-    trip_data = []
-    for trip in trips:
-        # Get user data for the trip
-        user_result = await db.execute(select(User).filter(User.id == trip.user_id))
-        user = user_result.scalar_one_or_none()
-        trip_data.append({
-            "id": trip.id,
-            "user_name": user.full_name if user else "Unknown",
-            "blockchain_id": trip.blockchain_id,
-            "starting_location": trip.starting_location,
-            "last_lat": trip.last_lat,
-            "last_lon": trip.last_lon,
-            "status": trip.status,
-            "tourist_destination_id": trip.tourist_destination_id,
-            "tourist_destination_name": get_tourist_place_by_id(int(str(trip.tourist_destination_id)))["name"],
-            "hotels": trip.hotels,
-            "mode_of_travel": trip.mode_of_travel,
-            "is_active": trip.is_active
-        })
-    
-    # Get active guide locations (updated within last 10 minutes)
-    ten_minutes_ago = datetime.utcnow() - timedelta(minutes=10)
-    guide_result = await db.execute(
-        select(GuideLocation, User)
-        .join(User, GuideLocation.guide_id == User.id)
-        .filter(GuideLocation.updated_at > ten_minutes_ago)
-    )
-    guide_locations = guide_result.all()
-    
-    guide_data = []
-    for guide_location, guide_user in guide_locations:
-        # Count assigned tourists for this guide
-        assigned_trips_result = await db.execute(
-            select(Trip).filter(Trip.guide_id == guide_user.id, Trip.is_active == True)
-        )
-        assigned_count = len(assigned_trips_result.scalars().all())
-        
-        guide_data.append({
-            "id": guide_user.id,
-            "guide_name": guide_user.full_name,
-            "guide_email": guide_user.email,
-            "latitude": guide_location.latitude,
-            "longitude": guide_location.longitude,
-            "updated_at": guide_location.updated_at.isoformat(),
-            "assigned_tourist_count": assigned_count,
-            "status": "active"
-        })
+    return StreamingResponse(_dashboard_chunks(db), media_type="application/json")
+
+async def _dashboard_chunks(db: AsyncSession):
+    """Encode the dashboard payload piece by piece, streaming tourists straight from the trip cursor"""
+    total_tourists = 0
+    yield b'{"tourists":['
+    async for row in stream_active_trip_rows(db, DASHBOARD_TRIP_FIELDS):
+        yield row if total_tourists == 0 else b"," + row
+        total_tourists += 1
     
-    return {
-        "tourists": trip_data,
-        "guides": guide_data,
-        "total_tourists": len(trip_data),
-        "total_guides": len(guide_data)
-    }
+    # Guide positions change far less often than the dashboard is polled, so they come from a short-lived cache
+    guides_json, total_guides = await get_guide_positions_json(db)
+    yield b'],"guides":' + guides_json
+    yield b',"total_tourists":%d,"total_guides":%d}' % (total_tourists, total_guides)
 
 @router.get("/tourist-places")
-async def get_tourist_places():
+async def get_tourist_places(request: Request):
     """Get all available Indian tourist places"""
-    return INDIAN_TOURIST_PLACES
\ No newline at end of file
+    # The table is static for the process lifetime, so clients can revalidate with its ETag
+    headers = {"ETag": TOURIST_PLACES_ETAG, "Cache-Control": "public, max-age=3600"}
+    if request.headers.get("if-none-match") == TOURIST_PLACES_ETAG:
+        return Response(status_code=304, headers=headers)
+    return Response(TOURIST_PLACES_JSON, media_type="application/json", headers=headers)
\ No newline at end of file
@@ -1,19 +1,20 @@
 # Authentication routes for the Tourist Safety Monitoring System
 
-from fastapi import APIRouter, Depends, HTTPException, Request, Form, status
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Request, Form, Cookie, status
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 from datetime import timedelta
+from typing import Optional
 
-from models import User, Trip, get_db
+from models import Role, User, Trip, get_db
 from schemas import UserCreate, Token, UserRegistration
 from services import get_tourist_place_by_id
 from config import INDIAN_TOURIST_PLACES
 from auth import (
-    authenticate_user, create_access_token, get_current_active_user,
-    ACCESS_TOKEN_EXPIRE_MINUTES
+    authenticate_user, create_access_token, get_current_active_user, invalidate_session,
+    ACCESS_TOKEN_EXPIRE_MINUTES, USER_BY_EMAIL
 )
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
@@ -22,7 +23,7 @@ router = APIRouter(prefix="/auth", tags=["authentication"])
 async def register_user(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     """Register a new user (admin or tourist)"""
     # Check if user already exists
-    result = await db.execute(select(User).filter(User.email == user_data.email))
+    result = await db.execute(USER_BY_EMAIL, {"email": user_data.email})
     existing_user = result.scalar_one_or_none()
     if existing_user:
         raise HTTPException(
@@ -39,22 +40,21 @@ async def register_user(user_data: UserCreate, db: AsyncSession = Depends(get_db
         )
     
     # Create new user
-    hashed_password = User.get_password_hash(user_data.password)
+    hashed_password = await asyncio.to_thread(User.get_password_hash, user_data.password)
     new_user = User(
         email=user_data.email,
         hashed_password=hashed_password,
         full_name=user_data.full_name,
-        role=user_data.role
+        role=Role(user_data.role)
     )
     
     db.add(new_user)
     await db.commit()
-    await db.refresh(new_user)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": new_user.email, "role": new_user.role},
+        data={"sub": user_data.email, "role": user_data.role},
         expires_delta=access_token_expires
     )
     
@@ -102,9 +102,9 @@ async def login_form(
     )
     
     # Set cookie and redirect based on role
-    if str(user.role) == "admin":
+    if user.role is Role.ADMIN:
         redirect_url = "/"
-    elif str(user.role) == "guide":
+    elif user.role is Role.GUIDE:
         redirect_url = "/guide-dashboard"
     else:
         redirect_url = "/tourist-dashboard"
@@ -122,8 +122,9 @@ async def login_form(
     return response
 
 @router.post("/logout")
-async def logout():
+async def logout(access_token: Optional[str] = Cookie(None)):
     """Logout user by clearing cookie"""
+    await invalidate_session(access_token)
     response = RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     response.delete_cookie("access_token")
     return response
\ No newline at end of file
@@ -1,11 +1,12 @@
 # Guide dashboard routes for the Tourist Safety Monitoring System
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, insert
+from sqlalchemy.orm import joinedload
 from models import User, Trip, GuideLocation, get_db
 from auth import require_guide, require_guide_flexible
-from services import get_tourist_place_by_id
+from services import get_tourist_place_by_id, invalidate_guide_positions
 from schemas import GuideLocationUpdate
 from datetime import datetime
 import json
@@ -28,18 +29,17 @@ async def get_guide_dashboard_data(
     """Get dashboard data for the current guide - only shows tourists assigned to this guide"""
     # Get all active trips where this guide is assigned
     result = await db.execute(
-        select(Trip).filter(Trip.guide_id == current_user.id, Trip.is_active == True)
+        select(Trip)
+        .options(joinedload(Trip.user))
+        .filter(Trip.guide_id == current_user.id, Trip.is_active == True)
     )
     trips = result.scalars().all()
     
     trip_data = []
     for trip in trips:
-        # Get user data for the trip
-        user_result = await db.execute(select(User).filter(User.id == trip.user_id))
-        user = user_result.scalar_one_or_none()
+        user = trip.user
         
         if user:
-            tourist_place = get_tourist_place_by_id(int(str(trip.tourist_destination_id)))
             trip_data.append({
                 "id": trip.id,
                 "user_name": user.full_name,
@@ -53,7 +53,7 @@ async def get_guide_dashboard_data(
                 "last_lon": trip.last_lon,
                 "status": trip.status,
                 "tourist_destination_id": trip.tourist_destination_id,
-                "tourist_destination_name": tourist_place["name"],
+                "tourist_destination_name": get_tourist_place_by_id(trip.tourist_destination_id)["name"],
                 "hotels": trip.hotels,
                 "mode_of_travel": trip.mode_of_travel,
                 "is_active": trip.is_active,
@@ -74,57 +74,40 @@ async def update_guide_location(
     db: AsyncSession = Depends(get_db)
 ):
     """Update guide location and broadcast to appropriate users"""
-    # Validate coordinates
-    try:
-        location_data.validate_coordinates()
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    now = datetime.utcnow()
+    position = {"latitude": location_data.latitude, "longitude": location_data.longitude, "updated_at": now}
     
-    # Store user data before any database operations that might detach the object
-    user_id = current_user.id
-    user_name = current_user.full_name
-    
-    # Check if guide already has a location record
+    # Update the guide's location row in place; only a first-ever update needs the INSERT
     result = await db.execute(
-        select(GuideLocation).filter(GuideLocation.guide_id == user_id)
+        update(GuideLocation)
+        .where(GuideLocation.guide_id == current_user.id)
+        .values(**position)
+        .returning(GuideLocation.id)
     )
-    guide_location = result.scalar_one_or_none()
-    
-    if guide_location:
-        # Update existing location using SQLAlchemy update
-        guide_location.latitude = location_data.latitude  # type: ignore
-        guide_location.longitude = location_data.longitude  # type: ignore
-        guide_location.updated_at = datetime.utcnow()  # type: ignore
-    else:
-        # Create new location record
-        guide_location = GuideLocation(
-            guide_id=user_id,
-            latitude=location_data.latitude,
-            longitude=location_data.longitude
-        )
-        db.add(guide_location)
+    if result.first() is None:
+        await db.execute(insert(GuideLocation).values(guide_id=current_user.id, **position))
     
     await db.commit()
-    await db.refresh(guide_location)
+    invalidate_guide_positions()
     
     # Prepare broadcast message
     message_data = {
         "type": "guide_location_update",
-        "guide_id": user_id,
-        "guide_name": user_name,
+        "guide_id": current_user.id,
+        "guide_name": current_user.full_name,
         "latitude": location_data.latitude,
         "longitude": location_data.longitude,
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": now.isoformat()
     }
     
     # Broadcast to appropriate users (admin + assigned tourists)
     if manager:
-        await manager.broadcast_guide_location_update(user_id, message_data)
+        await manager.broadcast_guide_location_update(current_user.id, message_data)
     
     return {
         "status": "success",
         "message": "Guide location updated successfully",
         "latitude": location_data.latitude,
         "longitude": location_data.longitude,
-        "updated_at": guide_location.updated_at.isoformat()
+        "updated_at": now.isoformat()
     }
\ No newline at end of file
@@ -1,26 +1,24 @@
 # Guide registration routes for the Tourist Safety Monitoring System
 
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, Request, Form, status
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 from datetime import timedelta
 
-from models import User, get_db
-from auth import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from models import Role, User, get_db
+from auth import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, USER_BY_EMAIL
+from page_templates import templates
 
 router = APIRouter(prefix="/guide-auth", tags=["guide-authentication"])
 
-# Initialize templates
-templates = Jinja2Templates(directory="templates")
+# The registration form has no dynamic content until an error is shown, so render it once
+GUIDE_REGISTER_PAGE_HTML = templates.get_template("guide_register.html").render()
 
 @router.get("/register", response_class=HTMLResponse)
 async def guide_register_page(request: Request):
     """Guide registration page"""
-    return templates.TemplateResponse("guide_register.html", {
-        "request": request
-    })
+    return HTMLResponse(GUIDE_REGISTER_PAGE_HTML, headers={"Cache-Control": "private, max-age=30"})
 
 @router.post("/register")
 async def register_guide(
@@ -36,7 +34,7 @@ async def register_guide(
     """Register a new guide with both user account and guide profile"""
     try:
         # Check if user already exists
-        result = await db.execute(select(User).filter(User.email == email))
+        result = await db.execute(USER_BY_EMAIL, {"email": email})
         existing_user = result.scalar_one_or_none()
         if existing_user:
             return templates.TemplateResponse("guide_register.html", {
@@ -45,7 +43,7 @@ async def register_guide(
             })
         
         # Create user account with guide role
-        hashed_password = User.get_password_hash(password)
+        hashed_password = await asyncio.to_thread(User.get_password_hash, password)
         new_user = User(
             email=email,
             hashed_password=hashed_password,
@@ -53,15 +51,14 @@ async def register_guide(
             contact_number=contact_number,
             age=age,
             gender=gender,
-            role="guide"
+            role=Role.GUIDE
         )
         
         db.add(new_user)
         await db.commit()
-        await db.refresh(new_user)
         
         # Create access token for auto-login
-        access_token = create_access_token(data={"sub": new_user.email})
+        access_token = create_access_token(data={"sub": email})
         
         # Create response to redirect to guide dashboard and set login cookie
         response = RedirectResponse(url="/guide-dashboard", status_code=status.HTTP_302_FOUND)
@@ -1,17 +1,21 @@
 # Tourist routes for the Tourist Safety Monitoring System
 
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, Request, Form, status
 from fastapi.responses import RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, desc
+from datetime import datetime
 import json
 
-from models import User, Trip, Incident, get_db
+from models import Role, User, Trip, Incident, GuideLocation, get_db
 from schemas import LocationUpdate
-from services import get_tourist_place_by_id, is_inside_geofence
+from services import get_geofence_by_id, is_inside_geofence_db, get_trip_position_context, UPDATE_TRIP_POSITION
 from websocket_manager import ConnectionManager
+from location_writer import batching_enabled, queue_position
 from config import INDIAN_TOURIST_PLACES
-from auth import get_current_active_user, get_current_active_user_flexible, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from auth import get_current_active_user, get_current_active_user_flexible, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, USER_BY_EMAIL
+from page_templates import templates
 
 router = APIRouter(prefix="/tourist", tags=["tourist"])
 
@@ -36,18 +40,16 @@ async def register_tourist(
     """Register a new tourist with both user account and tourist profile"""
     try:
         # Check if user already exists
-        result = await db.execute(select(User).filter(User.email == email))
+        result = await db.execute(USER_BY_EMAIL, {"email": email})
         existing_user = result.scalar_one_or_none()
         if existing_user:
-            from fastapi.templating import Jinja2Templates
-            templates = Jinja2Templates(directory="templates")
             return templates.TemplateResponse("register.html", {
                 "request": request,
                 "error": "Email already registered"
             })
         
         # Create user account
-        hashed_password = User.get_password_hash(password)
+        hashed_password = await asyncio.to_thread(User.get_password_hash, password)
         new_user = User(
             email=email,
             hashed_password=hashed_password,
@@ -55,15 +57,14 @@ async def register_tourist(
             contact_number=contact_number,
             age=age,
             gender="M",  # Default gender - can be updated later in profile
-            role="tourist"
+            role=Role.TOURIST
         )
         
         db.add(new_user)
         await db.commit()
-        await db.refresh(new_user)
         
         # Create access token for auto-login
-        access_token = create_access_token(data={"sub": new_user.email})
+        access_token = create_access_token(data={"sub": email})
         
         # Create response to redirect to tourist dashboard and set login cookie
         response = RedirectResponse(url="/tourist-dashboard", status_code=status.HTTP_302_FOUND)
@@ -81,8 +82,6 @@ async def register_tourist(
         
     except Exception as e:
         # Return to registration form with error message
-        from fastapi.templating import Jinja2Templates
-        templates = Jinja2Templates(directory="templates")
         return templates.TemplateResponse("register.html", {
             "request": request,
             "error": f"Registration failed: {str(e)}"
@@ -95,78 +94,72 @@ async def update_location(
     db: AsyncSession = Depends(get_db)
 ):
     """Update tourist location and check geofence status"""
-    # Validate coordinates
-    try:
-        location_data.validate_coordinates()
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    
-    result = await db.execute(select(Trip).filter(Trip.id == location_data.trip_id))
-    trip = result.scalar_one_or_none()
+    # Static trip fields only (cached per trip); the position itself is written by a single UPDATE below
+    trip = await get_trip_position_context(db, location_data.trip_id)
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
     # SECURITY: Default-deny authorization - only allow role="tourist" and "guide" to update positions
     # All other roles are explicitly denied
-    if str(current_user.role) not in ["tourist", "guide"]:
+    if current_user.role not in (Role.TOURIST, Role.GUIDE):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied: Only tourists and guides can update location positions"
         )
     
     # Authorization: tourists can update their own trip location, guides can update trips they are assigned to
-    if str(current_user.role) == "tourist":
-        if int(str(trip.user_id)) != current_user.id:
+    if current_user.role is Role.TOURIST:
+        if trip.user_id != current_user.id:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Access denied: You can only update your own trip location"
             )
-    elif str(current_user.role) == "guide":
+    elif current_user.role is Role.GUIDE:
         # Guides can update location for trips they are assigned to or their own location if they have a trip
-        guide_id = trip.guide_id if trip.guide_id is not None else 0
-        if int(str(guide_id)) != current_user.id and int(str(trip.user_id)) != current_user.id:
+        if trip.guide_id != current_user.id and trip.user_id != current_user.id:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Access denied: You can only update location for trips assigned to you"
             )
     
-    # Store trip data before session operations to avoid detachment issues
-    trip_id = trip.id
-    trip_user_id = trip.user_id
-    # Get user name for the trip
-    user_result = await db.execute(select(User).filter(User.id == trip.user_id))
-    user = user_result.scalar_one_or_none()
-    trip_user_name = user.full_name if user else "Unknown"
-    
-    # Update location
-    trip.last_lat = location_data.latitude  # type: ignore
-    trip.last_lon = location_data.longitude  # type: ignore
-    
     # Check geofence status for trip's destination
-    inside_fence = is_inside_geofence(location_data.latitude, location_data.longitude, int(str(trip.tourist_destination_id)))
+    inside_fence = await is_inside_geofence_db(db, location_data.latitude, location_data.longitude, trip.tourist_destination_id)
     new_status = "Safe" if inside_fence else "Critical"
     
-    # Log incident if status changed to Critical
-    current_status = str(trip.status)
-    if current_status != "Critical" and new_status == "Critical":
-        incident = Incident(trip_id=trip_id, severity="Critical")
-        db.add(incident)
-    
-    trip.status = new_status  # type: ignore
-    await db.commit()
+    if batching_enabled():
+        # Written (and any incident logged) by the next batched flush
+        queue_position(location_data.trip_id, location_data.latitude, location_data.longitude, new_status)
+    else:
+        # Update location and status in one statement that also returns the previous status
+        result = await db.execute(UPDATE_TRIP_POSITION, {
+            "trip_id": location_data.trip_id,
+            "new_lat": location_data.latitude,
+            "new_lon": location_data.longitude,
+            "new_status": new_status
+        })
+        previous = result.first()
+        if previous is None:
+            # Deleted between the read and the write
+            raise HTTPException(status_code=404, detail="Trip not found")
+        
+        # Log incident if status changed to Critical
+        if previous.status != "Critical" and new_status == "Critical":
+            db.add(Incident(trip_id=location_data.trip_id, severity="Critical"))
+        
+        await db.commit()
     
-    # Broadcast location update via WebSocket using stored values with role-based filtering
+    # Broadcast location update via WebSocket with role-based filtering
     update_message = {
         "type": "location_update",
-        "trip_id": int(str(trip_id)),
-        "tourist_id": int(str(trip_user_id)),
-        "name": trip_user_name,
+        "trip_id": location_data.trip_id,
+        "tourist_id": trip.user_id,
+        "name": trip.full_name or "Unknown",
         "latitude": location_data.latitude,
         "longitude": location_data.longitude,
         "status": new_status,
         "inside_fence": inside_fence
     }
-    await manager.broadcast_location_update(int(str(trip_id)), update_message)
+    await manager.broadcast_location_update(location_data.trip_id, update_message)
     
     return {"status": new_status, "inside_fence": inside_fence}
 
@@ -177,36 +170,28 @@ async def get_map_data(
     db: AsyncSession = Depends(get_db)
 ):
     """Get initial map data for a specific trip"""
-    result = await db.execute(select(Trip).filter(Trip.id == trip_id))
-    trip = result.scalar_one_or_none()
+    trip = await db.get(Trip, trip_id)
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
     # Check if user has permission to view this trip's data
-    if str(current_user.role) == "tourist" and int(str(trip.user_id)) != current_user.id:
+    if current_user.role is Role.TOURIST and trip.user_id != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You can only view your own trip data"
         )
     
-    # Get the trip's destination location
-    tourist_place = get_tourist_place_by_id(int(str(trip.tourist_destination_id)))
-    
     # Get user data for the trip
-    user_result = await db.execute(select(User).filter(User.id == trip.user_id))
-    user = user_result.scalar_one_or_none()
+    user = await db.get(User, trip.user_id)
     
     # Get guide information if assigned
     assigned_guide = None
     if trip.guide_id:
         # Fetch guide user info
-        guide_result = await db.execute(select(User).filter(User.id == trip.guide_id))
-        guide_user = guide_result.scalar_one_or_none()
+        guide_user = await db.get(User, trip.guide_id)
         
         if guide_user:
             # Get guide's latest location
-            from models import GuideLocation
-            from sqlalchemy import desc
             guide_location_result = await db.execute(
                 select(GuideLocation)
                 .filter(GuideLocation.guide_id == guide_user.id)
@@ -216,7 +201,6 @@ async def get_map_data(
             guide_location = guide_location_result.scalar_one_or_none()
             
             # Determine guide GPS status
-            from datetime import datetime, timedelta
             guide_gps_working = False
             guide_status = "no_location"
             
@@ -251,10 +235,5 @@ async def get_map_data(
             "mode_of_travel": trip.mode_of_travel
         },
         "guide": assigned_guide,
-        "geofence": {
-            "center_lat": tourist_place["lat"],
-            "center_lon": tourist_place["lon"],
-            "radius": tourist_place["radius"],
-            "name": tourist_place["name"]
-        }
+        "geofence": get_geofence_by_id(trip.tourist_destination_id)
     }
\ No newline at end of file
@@ -1,7 +1,38 @@
 # Pydantic models for request/response validation
 
-from pydantic import BaseModel
-from typing import Optional, List
+import math
+from pydantic import BaseModel, Field
+from typing import Annotated, Optional, List
+
+# Coordinates are range-checked (and NaN/infinity rejected) while parsing the request, so invalid
+# input is refused before any database work; coordinate_error_message keeps the 400 + message reply
+Latitude = Annotated[float, Field(ge=-90, le=90, allow_inf_nan=False)]
+Longitude = Annotated[float, Field(ge=-180, le=180, allow_inf_nan=False)]
+
+COORDINATE_RANGE_MESSAGES = {
+    "latitude": "Latitude must be between -90 and 90 degrees",
+    "longitude": "Longitude must be between -180 and 180 degrees"
+}
+
+def coordinate_error_message(errors: list) -> Optional[str]:
+    """Client-facing message when every validation error is a bad latitude/longitude value, else None"""
+    message = None
+    for error in errors:
+        loc = error.get("loc", ())
+        if len(loc) != 2 or loc[0] != "body" or loc[1] not in COORDINATE_RANGE_MESSAGES:
+            return None
+        if error["type"] == "finite_number":
+            try:
+                is_nan = math.isnan(float(error["input"]))
+            except (TypeError, ValueError):
+                is_nan = False
+            error_message = "Latitude and longitude cannot be NaN" if is_nan else "Latitude and longitude cannot be infinite"
+        elif error["type"] in ("greater_than_equal", "less_than_equal"):
+            error_message = COORDINATE_RANGE_MESSAGES[loc[1]]
+        else:
+            return None
+        message = message or error_message
+    return message
 
 class UserRegistration(BaseModel):
     full_name: str
@@ -34,48 +65,12 @@ class Token(BaseModel):
 
 class LocationUpdate(BaseModel):
     trip_id: int
-    latitude: float
-    longitude: float
-    
-    def validate_coordinates(self):
-        # Check for NaN, infinity, or None values
-        if self.latitude is None or self.longitude is None:
-            raise ValueError("Latitude and longitude cannot be null")
-        
-        import math
-        if math.isnan(self.latitude) or math.isnan(self.longitude):
-            raise ValueError("Latitude and longitude cannot be NaN")
-        
-        if math.isinf(self.latitude) or math.isinf(self.longitude):
-            raise ValueError("Latitude and longitude cannot be infinite")
-        
-        # Check coordinate ranges
-        if not (-90 <= self.latitude <= 90):
-            raise ValueError("Latitude must be between -90 and 90 degrees")
-        if not (-180 <= self.longitude <= 180):
-            raise ValueError("Longitude must be between -180 and 180 degrees")
+    latitude: Latitude
+    longitude: Longitude
 
 class GuideLocationUpdate(BaseModel):
-    latitude: float
-    longitude: float
-    
-    def validate_coordinates(self):
-        # Check for NaN, infinity, or None values
-        if self.latitude is None or self.longitude is None:
-            raise ValueError("Latitude and longitude cannot be null")
-        
-        import math
-        if math.isnan(self.latitude) or math.isnan(self.longitude):
-            raise ValueError("Latitude and longitude cannot be NaN")
-        
-        if math.isinf(self.latitude) or math.isinf(self.longitude):
-            raise ValueError("Latitude and longitude cannot be infinite")
-        
-        # Check coordinate ranges
-        if not (-90 <= self.latitude <= 90):
-            raise ValueError("Latitude must be between -90 and 90 degrees")
-        if not (-180 <= self.longitude <= 180):
-            raise ValueError("Longitude must be between -180 and 180 degrees")
+    latitude: Latitude
+    longitude: Longitude
 
 class TripData(BaseModel):
     id: int
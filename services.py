@@ -1,15 +1,75 @@
 # Business logic services for the Tourist Safety Monitoring System
 
+import hashlib
+from datetime import datetime, timedelta
 import math
-from typing import Optional
+import orjson
+from markupsafe import Markup, escape
+from cachetools import TTLCache
+from typing import AsyncIterator, Optional, Sequence
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from models import User, Trip, AsyncSessionLocal
-from config import INDIAN_TOURIST_PLACES
+from sqlalchemy import Row, select, update, bindparam, exists, func, cast
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import Role, User, Trip, GuideLocation, AsyncSessionLocal, Geography, tourist_places_table, USE_POSTGIS
+from config import INDIAN_TOURIST_PLACES, GUIDE_POSITIONS_CACHE_TTL, TRIP_CONTEXT_CACHE_TTL, WS_CONTEXT_CACHE_TTL
+
+EARTH_RADIUS_M = 6371000  # Earth's radius in meters
+DEG_TO_RAD = math.pi / 180.0  # same factor math.radians applies, without the call
+
+# Place lookups by ID, built once instead of scanning INDIAN_TOURIST_PLACES per call
+_ID_TO_PLACE = {place["id"]: place for place in INDIAN_TOURIST_PLACES}
+VALID_LOCATION_IDS = frozenset(_ID_TO_PLACE)
+TOURIST_PLACES_JSON = orjson.dumps(INDIAN_TOURIST_PLACES)  # served as-is by the tourist-places endpoints
+TOURIST_PLACES_ETAG = '"' + hashlib.md5(TOURIST_PLACES_JSON).hexdigest() + '"'
+
+# Per-request trip lookups built once so repeat executions reuse the cached compiled statement
+ACTIVE_TRIP_BY_USER = select(Trip).filter(Trip.user_id == bindparam("user_id"), Trip.is_active == True)
+ACTIVE_TRIP_ROUTE_BY_USER = select(Trip.id, Trip.guide_id).filter(Trip.user_id == bindparam("user_id"), Trip.is_active == True).limit(1)
+ACTIVE_TRIP_IDS_BY_GUIDE = select(Trip.id).filter(Trip.guide_id == bindparam("guide_id"), Trip.is_active == True)
+
+# Location updates: the trip fields needed for authorization, the geofence and the broadcast, then one
+# UPDATE that writes the new position and returns the status it replaced (read from a locked self-join)
+TRIP_POSITION_CONTEXT = (
+    select(Trip.user_id, Trip.guide_id, Trip.tourist_destination_id, User.full_name)
+    .outerjoin(User, User.id == Trip.user_id)
+    .filter(Trip.id == bindparam("trip_id"))
+)
+_previous_trip_status = (
+    select(Trip.id, Trip.status).filter(Trip.id == bindparam("trip_id")).with_for_update().subquery("previous")
+)
+UPDATE_TRIP_POSITION = (
+    update(Trip)
+    .where(Trip.id == _previous_trip_status.c.id)
+    .values(last_lat=bindparam("new_lat"), last_lon=bindparam("new_lon"), status=bindparam("new_status"))
+    .returning(_previous_trip_status.c.status)
+    .execution_options(synchronize_session=False)
+)
+
+# <option> list for the destination picker, rendered once instead of looping in Jinja per request
+TOURIST_PLACE_OPTIONS_HTML = Markup("".join(
+    f'<option value="{place["id"]}">{escape(place["name"])}</option>' for place in INDIAN_TOURIST_PLACES
+))
+
+# Geofence table precomputed once (indexed via _ID_TO_IDX) so checks skip the place scan and the
+# per-call radians/cos of the center. Each place stores (lat_rad, lon_rad, cos_lat, max_a, max_dlat)
+# where max_a = sin^2(radius / 2R) is the haversine term at the fence edge, so distance <= radius
+# becomes a <= max_a (no asin/sqrt per call), and max_dlat = radius / R is the largest latitude
+# offset (radians) a point inside can have
+_ID_TO_IDX = {place["id"]: idx for idx, place in enumerate(INDIAN_TOURIST_PLACES)}
+_PLACES_SCALAR = tuple(
+    (
+        place["lat"] * DEG_TO_RAD,
+        place["lon"] * DEG_TO_RAD,
+        math.cos(place["lat"] * DEG_TO_RAD),
+        math.sin(place["radius"] / (2 * EARTH_RADIUS_M)) ** 2,
+        place["radius"] / EARTH_RADIUS_M
+    )
+    for place in INDIAN_TOURIST_PLACES
+)
 
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculate distance between two points in meters using Haversine formula"""
-    R = 6371000  # Earth's radius in meters
+    R = EARTH_RADIUS_M
     
     lat1_rad = math.radians(lat1)
     lat2_rad = math.radians(lat2)
@@ -19,74 +79,281 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     a = (math.sin(delta_lat / 2) ** 2 +
          math.cos(lat1_rad) * math.cos(lat2_rad) *
          math.sin(delta_lon / 2) ** 2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    # asin(sqrt(a)) equals atan2(sqrt(a), sqrt(1 - a)) with one transcendental fewer; a is clamped for rounding
+    c = 2 * math.asin(math.sqrt(min(a, 1.0)))
     
     return R * c
 
-def is_inside_geofence(lat: float, lon: float, location_id: int = 1) -> bool:
+def is_inside_geofence(lat: float, lon: float, location_id: int = 1, _sin=math.sin, _cos=math.cos) -> bool:
     """Check if coordinates are inside the geofence for a specific tourist location"""
-    # Find the tourist place by location_id
-    tourist_place = next((place for place in INDIAN_TOURIST_PLACES if place["id"] == location_id), INDIAN_TOURIST_PLACES[0])
+    # Unknown locations fall back to the first tourist place
+    center_lat, center_lon, center_cos_lat, max_a, max_dlat = _PLACES_SCALAR[_ID_TO_IDX.get(location_id, 0)]
+    
+    # sin/cos are bound as defaults so the hot path does local loads instead of module attribute lookups
+    lat_rad = lat * DEG_TO_RAD
+    # a >= sin^2(dlat / 2), so a latitude offset beyond the radius is outside without any sin/cos
+    if abs(center_lat - lat_rad) > max_dlat:
+        return False
+    sin_half_dlat = _sin((center_lat - lat_rad) * 0.5)
+    sin_half_dlon = _sin((center_lon - lon * DEG_TO_RAD) * 0.5)
+    
+    a = sin_half_dlat * sin_half_dlat + _cos(lat_rad) * center_cos_lat * sin_half_dlon * sin_half_dlon
+    return a <= max_a
+
+def _geography_point(lat: float, lon: float):
+    """Build a PostGIS geography point expression (note PostGIS takes lon, lat)"""
+    return cast(func.ST_SetSRID(func.ST_MakePoint(lon, lat), 4326), Geography())
+
+async def is_inside_geofence_db(db: AsyncSession, lat: float, lon: float, location_id: int = 1) -> bool:
+    """Geofence check evaluated by PostGIS via a GiST-indexed ST_DWithin; uses is_inside_geofence when PostGIS is off"""
+    if not USE_POSTGIS:
+        return is_inside_geofence(lat, lon, location_id)
+    
+    # Unknown locations fall back to the first tourist place, as in is_inside_geofence
+    if location_id not in _ID_TO_IDX:
+        location_id = INDIAN_TOURIST_PLACES[0]["id"]
     
-    distance = calculate_distance(
-        lat, lon, 
-        tourist_place["lat"], tourist_place["lon"]
+    places = tourist_places_table.c
+    stmt = select(exists().where(
+        places.id == location_id,
+        func.ST_DWithin(places.center, _geography_point(lat, lon), places.radius_m)
+    ))
+    return bool(await db.scalar(stmt))
+
+async def sync_tourist_places():
+    """Mirror INDIAN_TOURIST_PLACES into the PostGIS tourist_places table"""
+    if not USE_POSTGIS:
+        return
+    
+    async with AsyncSessionLocal() as db:
+        stmt = pg_insert(tourist_places_table).values([
+            {
+                "id": place["id"],
+                "name": place["name"],
+                "center": _geography_point(place["lat"], place["lon"]),
+                "radius_m": place["radius"]
+            }
+            for place in INDIAN_TOURIST_PLACES
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={"name": stmt.excluded.name, "center": stmt.excluded.center, "radius_m": stmt.excluded.radius_m}
+        )
+        await db.execute(stmt)
+        await db.commit()
+
+# Precomputed pbkdf2_sha256 digests of the demo passwords (admin123, tourist123, guide123)
+# so startup seeding does no password hashing
+DEMO_ADMIN_HASH = "$pbkdf2-sha256$29000$NQbAeE8JIYQw5nzPGSPEuA$2ADhphKNuRV3yRR/jrfacHW1aGwrOZBhh5As.nPlrkw"
+DEMO_TOURIST_HASH = "$pbkdf2-sha256$29000$PYfwPqfUulcq5Xzv/b/Xug$gYpV0f/PO2t3EA2ElX8a5eYvPmbDrpjGQkDum/bN1y8"
+DEMO_GUIDE_HASH = "$pbkdf2-sha256$29000$dy5lrDWG8H4v5VwrxZgzBg$5UEUUBsDGTmuY6LdCrwarL/4gS53C3XYaKE83qr27ow"
+
+async def count_active_trips_by_guide(db: AsyncSession) -> dict[int, int]:
+    """Number of active trips assigned to each guide, in one grouped query"""
+    result = await db.execute(
+        select(Trip.guide_id, func.count())
+        .filter(Trip.guide_id.is_not(None), Trip.is_active == True)
+        .group_by(Trip.guide_id)
     )
-    return distance <= tourist_place["radius"]
+    return dict(result.tuples().all())
+
+# Active trips as plain dashboard rows: user names are joined server-side and no ORM objects are built
+ACTIVE_TRIP_ROWS = (
+    select(
+        Trip.id,
+        func.coalesce(User.full_name, "Unknown").label("user_name"),
+        Trip.blockchain_id,
+        Trip.starting_location,
+        Trip.last_lat,
+        Trip.last_lon,
+        Trip.status,
+        Trip.tourist_destination_id,
+        Trip.hotels,
+        Trip.mode_of_travel,
+        Trip.is_active
+    )
+    .outerjoin(User, User.id == Trip.user_id)
+    .filter(Trip.is_active == True)
+    .execution_options(yield_per=200)
+)
+
+async def stream_active_trip_rows(
+    db: AsyncSession,
+    fields: Sequence[str],
+    status: Optional[str] = None,
+    skip: int = 0,
+    limit: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """Yield each active trip as a JSON object (only the given fields) straight off a server-side cursor"""
+    # Filtering and paging are pushed into SQL so only the requested rows leave the database
+    stmt = ACTIVE_TRIP_ROWS
+    if status is not None:
+        stmt = stmt.filter(Trip.status == status)
+    if skip or limit is not None:
+        stmt = stmt.order_by(Trip.id).offset(skip).limit(limit)
+    result = await db.stream(stmt)
+    async for row in result.mappings():
+        # The destination name comes from the in-memory place table rather than the database
+        yield orjson.dumps({
+            field: get_tourist_place_by_id(row["tourist_destination_id"])["name"] if field == "tourist_destination_name" else row[field]
+            for field in fields
+        })
+
+async def stream_json_array(items: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Wrap a stream of encoded JSON values in array brackets and separators"""
+    yield b"["
+    separator = b""
+    async for item in items:
+        yield separator + item
+        separator = b","
+    yield b"]"
+
+# trip ID -> TRIP_POSITION_CONTEXT row. Owner, guide and destination are fixed once a trip is created,
+# so a tourist streaming positions only pays for the UPDATE after the first fix
+_trip_context_cache: TTLCache = TTLCache(maxsize=10_000, ttl=TRIP_CONTEXT_CACHE_TTL)
+
+async def get_trip_position_context(db: AsyncSession, trip_id: int) -> Optional[Row]:
+    """(user_id, guide_id, tourist_destination_id, full_name) for a trip, or None if it does not exist"""
+    cached = _trip_context_cache.get(trip_id)
+    if cached is not None:
+        return cached
+    result = await db.execute(TRIP_POSITION_CONTEXT, {"trip_id": trip_id})
+    context = result.first()
+    if context is not None:
+        _trip_context_cache[trip_id] = context
+    return context
+
+# Encoded list of recently active guides for the admin dashboard, shared by every poll until a
+# guide moves or the TTL passes (the TTL also bounds staleness across workers)
+_GUIDE_POSITIONS_KEY = "guide_positions"
+_guide_positions_cache: TTLCache = TTLCache(maxsize=1, ttl=GUIDE_POSITIONS_CACHE_TTL)
+
+async def get_guide_positions_json(db: AsyncSession) -> tuple[bytes, int]:
+    """JSON array of guides with a location update in the last 10 minutes, and its length"""
+    cached = _guide_positions_cache.get(_GUIDE_POSITIONS_KEY)
+    if cached is not None:
+        return cached
+    
+    ten_minutes_ago = datetime.utcnow() - timedelta(minutes=10)
+    guide_result = await db.execute(
+        select(GuideLocation, User)
+        .join(User, GuideLocation.guide_id == User.id)
+        .filter(GuideLocation.updated_at > ten_minutes_ago)
+    )
+    guide_locations = guide_result.all()
+    assigned_counts = await count_active_trips_by_guide(db)
+    
+    guide_data = [
+        {
+            "id": guide_user.id,
+            "guide_name": guide_user.full_name,
+            "guide_email": guide_user.email,
+            "latitude": guide_location.latitude,
+            "longitude": guide_location.longitude,
+            "updated_at": guide_location.updated_at.isoformat(),
+            "assigned_tourist_count": assigned_counts.get(guide_user.id, 0),
+            "status": "active"
+        }
+        for guide_location, guide_user in guide_locations
+    ]
+    
+    payload = (orjson.dumps(guide_data), len(guide_data))
+    _guide_positions_cache[_GUIDE_POSITIONS_KEY] = payload
+    return payload
+
+def invalidate_guide_positions():
+    """Drop the cached guide-position list after a guide location write"""
+    _guide_positions_cache.pop(_GUIDE_POSITIONS_KEY, None)
+
+# user ID -> (active trip id/guide_id row, assigned trip IDs) for WebSocket connects; reconnecting clients skip the trip
+# queries. Entries are dropped on every worker (via ConnectionManager.invalidate_ws_context) whenever a trip starts or
+# ends and otherwise expire after the TTL. Empty contexts are not cached, so a trip created moments ago is never hidden.
+_ws_context_cache: TTLCache = TTLCache(maxsize=10_000, ttl=WS_CONTEXT_CACHE_TTL)
+
+async def get_ws_context(db: AsyncSession, user: User) -> tuple[Optional[Row], list[int]]:
+    """Active trip (tourists) or assigned active trip IDs (guides) used to route a user's broadcasts"""
+    cached = _ws_context_cache.get(user.id)
+    if cached is not None:
+        return cached
+    
+    trip = None
+    assigned_trip_ids = []
+    if user.role is Role.TOURIST:
+        # Only the routing columns; no Trip object is hydrated
+        result = await db.execute(ACTIVE_TRIP_ROUTE_BY_USER, {"user_id": user.id})
+        trip = result.first()
+    elif user.role is Role.GUIDE:
+        # For guides, load all trips they are assigned to
+        result = await db.execute(ACTIVE_TRIP_IDS_BY_GUIDE, {"guide_id": user.id})
+        assigned_trip_ids = list(result.scalars().all())
+    
+    context = (trip, assigned_trip_ids)
+    if trip is not None or assigned_trip_ids:
+        _ws_context_cache[user.id] = context
+    return context
+
+def invalidate_ws_context(*user_ids: Optional[int]):
+    """Forget cached WebSocket routing for users whose trips changed"""
+    for user_id in user_ids:
+        if user_id is not None:
+            _ws_context_cache.pop(user_id, None)
+
+def clear_ws_context():
+    """Forget all cached WebSocket routing (after invalidations may have been missed)"""
+    _ws_context_cache.clear()
 
 def get_tourist_place_by_id(location_id: int):
     """Get tourist place details by ID"""
-    return next((place for place in INDIAN_TOURIST_PLACES if place["id"] == location_id), INDIAN_TOURIST_PLACES[0])
+    return _ID_TO_PLACE.get(location_id, INDIAN_TOURIST_PLACES[0])
+
+# Geofence context for the map pages and map API, built once per place; treat the dicts as read-only
+_ID_TO_GEOFENCE = {
+    place["id"]: {"center_lat": place["lat"], "center_lon": place["lon"], "radius": place["radius"], "name": place["name"]}
+    for place in INDIAN_TOURIST_PLACES
+}
+DEFAULT_GEOFENCE = {"center_lat": 28.6129, "center_lon": 77.2295, "radius": 400, "name": "Default Location"}
+
+def get_geofence_by_id(location_id: int) -> dict:
+    """Geofence context (center, radius, name) of a tourist place; unknown IDs fall back like get_tourist_place_by_id"""
+    return _ID_TO_GEOFENCE.get(location_id, _ID_TO_GEOFENCE[INDIAN_TOURIST_PLACES[0]["id"]])
 
 async def create_demo_users():
-    """Create demo admin and tourist users"""
+    """Create demo admin, tourist and guide users"""
     async with AsyncSessionLocal() as db:
         try:
-            # Check if demo admin exists
-            result = await db.execute(select(User).filter(User.email == "admin@demo.com"))
-            admin_exists = result.scalar_one_or_none()
-            if not admin_exists:
-                admin_user = User(
-                    email="admin@demo.com",
-                    hashed_password=User.get_password_hash("admin123"),
-                    full_name="Admin User",
-                    contact_number="+1234567890",
-                    age=30,
-                    gender="M",
-                    role="admin"
-                )
-                db.add(admin_user)
-                
-            # Check if demo tourist exists  
-            result = await db.execute(select(User).filter(User.email == "tourist@demo.com"))
-            tourist_exists = result.scalar_one_or_none()
-            if not tourist_exists:
-                tourist_user = User(
-                    email="tourist@demo.com",
-                    hashed_password=User.get_password_hash("tourist123"),
-                    full_name="Demo Tourist",
-                    contact_number="+1234567891",
-                    age=25,
-                    gender="F",
-                    role="tourist"
-                )
-                db.add(tourist_user)
-                # Note: Trip will be created when user starts a trip, not automatically
-            
-            # Check if demo guide exists  
-            result = await db.execute(select(User).filter(User.email == "guide@demo.com"))
-            guide_exists = result.scalar_one_or_none()
-            if not guide_exists:
-                guide_user = User(
-                    email="guide@demo.com",
-                    hashed_password=User.get_password_hash("guide123"),
-                    full_name="Demo Guide",
-                    contact_number="+1234567892",
-                    age=28,
-                    gender="M",
-                    role="guide"
-                )
-                db.add(guide_user)
+            demo_users = [
+                {
+                    "email": "admin@demo.com",
+                    "hashed_password": DEMO_ADMIN_HASH,
+                    "full_name": "Admin User",
+                    "contact_number": "+1234567890",
+                    "age": 30,
+                    "gender": "M",
+                    "role": Role.ADMIN
+                },
+                {
+                    # Note: Trip will be created when user starts a trip, not automatically
+                    "email": "tourist@demo.com",
+                    "hashed_password": DEMO_TOURIST_HASH,
+                    "full_name": "Demo Tourist",
+                    "contact_number": "+1234567891",
+                    "age": 25,
+                    "gender": "F",
+                    "role": Role.TOURIST
+                },
+                {
+                    "email": "guide@demo.com",
+                    "hashed_password": DEMO_GUIDE_HASH,
+                    "full_name": "Demo Guide",
+                    "contact_number": "+1234567892",
+                    "age": 28,
+                    "gender": "M",
+                    "role": Role.GUIDE
+                }
+            ]
+            # Single upsert; existing demo accounts are left untouched
+            stmt = pg_insert(User).values(demo_users).on_conflict_do_nothing(index_elements=["email"])
+            await db.execute(stmt)
             
             await db.commit()
         except Exception as e:
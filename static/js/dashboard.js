@@ -29,6 +29,7 @@ touristPlaces.forEach(place => {
 // Add tourist and guide markers - this will be populated by template data
 const touristMarkers = {};
 const guideMarkers = {};
+const textDecoder = new TextDecoder(); // Decodes binary WebSocket frames
 
 // Create custom icons for different marker types
 const touristIcon = L.divIcon({
@@ -79,6 +80,20 @@ function initializeGuideMarkers(guides) {
     });
 }
 
+function handleDashboardMessage(data) {
+    if (data.type === 'location_update') {
+        console.log('Updating tourist on dashboard:', data);
+        updateTouristOnMap(data);
+        updateTouristInTable(data);
+    } else if (data.type === 'tourist_status_change') {
+        console.log('Tourist status change:', data);
+        handleTouristStatusChange(data);
+    } else if (data.type === 'guide_location_update') {
+        console.log('Updating guide location on dashboard:', data);
+        updateGuideOnMap(data);
+    }
+}
+
 // WebSocket connection for live updates
 function initializeDashboardWebSocket() {
     const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
@@ -86,6 +101,8 @@ function initializeDashboardWebSocket() {
     
     // Use cookie-based authentication (no token in URL for security)
     const ws = new WebSocket(`${wsProtocol}//${wsHost}/ws/location`);
+    // Updates arrive as binary UTF-8 JSON frames
+    ws.binaryType = 'arraybuffer';
 
     ws.onopen = function(event) {
         console.log('WebSocket connection established for dashboard');
@@ -93,18 +110,11 @@ function initializeDashboardWebSocket() {
 
     ws.onmessage = function(event) {
         console.log('Dashboard WebSocket message received:', event.data);
-        const data = JSON.parse(event.data);
-        if (data.type === 'location_update') {
-            console.log('Updating tourist on dashboard:', data);
-            updateTouristOnMap(data);
-            updateTouristInTable(data);
-        } else if (data.type === 'tourist_status_change') {
-            console.log('Tourist status change:', data);
-            handleTouristStatusChange(data);
-        } else if (data.type === 'guide_location_update') {
-            console.log('Updating guide location on dashboard:', data);
-            updateGuideOnMap(data);
-        }
+        const text = event.data instanceof ArrayBuffer ? textDecoder.decode(event.data) : event.data;
+        const data = JSON.parse(text);
+        // The server coalesces bursts of updates into a single batch frame
+        const messages = data.type === 'batch' ? data.items : [data];
+        messages.forEach(handleDashboardMessage);
     };
 
     ws.onerror = function(error) {
@@ -1,6 +1,7 @@
 // Global variables (to be set by template)
 let tourist, geofence, currentUserRole, isAdmin;
 let ws; // Global WebSocket variable
+const textDecoder = new TextDecoder(); // Decodes binary WebSocket frames
 
 // Current position
 let currentLat, currentLon;
@@ -56,6 +57,24 @@ function initializeMap(touristData, geofenceData, userRole) {
     window.focus();
 }
 
+function handleMapMessage(data) {
+    if (data.type === 'location_update' && data.tourist_id === tourist.id) {
+        console.log('Updating tourist status via WebSocket:', data);
+        updateStatus(data);
+        
+        // Also update coordinates display and marker position
+        currentLat = data.latitude;
+        currentLon = data.longitude;
+        touristMarker.setLatLng([data.latitude, data.longitude]);
+        map.setView([data.latitude, data.longitude]);
+        document.getElementById('coordinates').textContent = 
+            `${data.latitude.toFixed(4)}, ${data.longitude.toFixed(4)}`;
+    } else if (data.type === 'guide_location_update') {
+        console.log('Received guide location update:', data);
+        updateGuideLocation(data);
+    }
+}
+
 // WebSocket connection
 function initializeWebSocket() {
     const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
@@ -63,6 +82,8 @@ function initializeWebSocket() {
     
     // Use cookie-based authentication (no token in URL for security)
     ws = new WebSocket(`${wsProtocol}//${wsHost}/ws/location`);
+    // Updates arrive as binary UTF-8 JSON frames
+    ws.binaryType = 'arraybuffer';
     
     ws.onopen = function(event) {
         console.log('WebSocket connection established for tourist map');
@@ -70,23 +91,11 @@ function initializeWebSocket() {
     
     ws.onmessage = function(event) {
         console.log('WebSocket message received:', event.data);
-        const data = JSON.parse(event.data);
-        
-        if (data.type === 'location_update' && data.tourist_id === tourist.id) {
-            console.log('Updating tourist status via WebSocket:', data);
-            updateStatus(data);
-            
-            // Also update coordinates display and marker position
-            currentLat = data.latitude;
-            currentLon = data.longitude;
-            touristMarker.setLatLng([data.latitude, data.longitude]);
-            map.setView([data.latitude, data.longitude]);
-            document.getElementById('coordinates').textContent = 
-                `${data.latitude.toFixed(4)}, ${data.longitude.toFixed(4)}`;
-        } else if (data.type === 'guide_location_update') {
-            console.log('Received guide location update:', data);
-            updateGuideLocation(data);
-        }
+        const text = event.data instanceof ArrayBuffer ? textDecoder.decode(event.data) : event.data;
+        const data = JSON.parse(text);
+        // The server coalesces bursts of updates into a single batch frame
+        const messages = data.type === 'batch' ? data.items : [data];
+        messages.forEach(handleMapMessage);
     };
     
     ws.onerror = function(error) {
@@ -1,150 +1,308 @@
 # WebSocket connection management for real-time communication
 
 from fastapi import WebSocket
-from typing import List, Optional
-import json
-from models import User, Trip
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple, Union
+import asyncio
+import time
+import orjson
+from sqlalchemy import Row
+from models import Role, User, Trip
+from services import clear_ws_context, invalidate_ws_context
+from config import BACKPLANE_RETRY_MIN, BACKPLANE_RETRY_MAX, WS_FLUSH_INTERVAL, WS_FLUSH_BYTES, WS_OUTBOX_MAX_SIZE, WS_DUPLICATE_WINDOW, WS_DUPLICATE_CACHE_SIZE, WS_FANOUT_BATCH
+
+# Backplane channels: one for admin-only notices plus a topic per trip and per guide
+ADMIN_CHANNEL = "admins"
+LOCATION_CHANNEL = "location"  # location:{trip_id}
+GUIDE_LOCATION_CHANNEL = "guide_location"  # guide_location:{guide_id}
+WS_CONTEXT_CHANNEL = "ws_context"  # JSON list of user IDs whose cached WebSocket routing is stale; not a broadcast
 
 class AuthenticatedConnection:
     """Represents an authenticated WebSocket connection with user information"""
-    def __init__(self, websocket: WebSocket, user: User, trip: Optional[Trip] = None, assigned_trip_ids: Optional[List[int]] = None):
+    # Fixed attribute layout: no per-connection __dict__, and broadcast loops read slots directly
+    __slots__ = ("websocket", "user", "trip", "assigned_trip_ids", "role", "trip_id", "guide_id", "outbox", "writer_task")
+
+    def __init__(self, websocket: WebSocket, user: User, trip: Optional[Union[Trip, Row]] = None, assigned_trip_ids: Optional[List[int]] = None):
         self.websocket = websocket
         self.user = user
-        self.trip = trip  # For tourists, this is their active trip
+        self.trip = trip  # For tourists, their active trip (a Trip or an (id, guide_id) row)
         self.assigned_trip_ids = assigned_trip_ids or []  # For guides, these are trip IDs they supervise
+        # Resolved once at connect time so broadcasts don't touch ORM attributes per message
+        self.role = Role(user.role)
+        self.trip_id = trip.id if trip is not None else None
+        self.guide_id = trip.guide_id if trip is not None else None
+        self.outbox: asyncio.Queue[bytes] = asyncio.Queue(maxsize=WS_OUTBOX_MAX_SIZE)
+        self.writer_task: Optional[asyncio.Task] = None
+
+    def enqueue(self, message: bytes):
+        """Queue a pre-serialized message for the writer task, dropping the oldest one on overflow"""
+        if self.outbox.full():
+            self.outbox.get_nowait()
+        self.outbox.put_nowait(message)
+
+def encode_message(data: Union[dict, bytes]) -> bytes:
+    """Serialize a message straight to UTF-8 JSON bytes for a binary frame (bytes pass through)"""
+    if isinstance(data, bytes):
+        return data
+    return orjson.dumps(data)
+
+def _add_to_bucket(buckets: Dict[int, Set[AuthenticatedConnection]], key: int, connection: AuthenticatedConnection):
+    buckets.setdefault(key, set()).add(connection)
+
+def _discard_from_bucket(buckets: Dict[int, Set[AuthenticatedConnection]], key: int, connection: AuthenticatedConnection):
+    bucket = buckets.get(key)
+    if bucket is not None:
+        bucket.discard(connection)
+        if not bucket:
+            del buckets[key]
+
+async def _enqueue_all(connections, message: bytes):
+    """Queue a message for every connection, yielding to the event loop between batches on large fan-outs"""
+    if len(connections) <= WS_FANOUT_BATCH:
+        for connection in connections:
+            connection.enqueue(message)
+        return
+    # Snapshot first: connects and disconnects may change the set while we yield
+    connections = tuple(connections)
+    for start in range(0, len(connections), WS_FANOUT_BATCH):
+        if start:
+            await asyncio.sleep(0)
+        for connection in connections[start:start + WS_FANOUT_BATCH]:
+            connection.enqueue(message)
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[AuthenticatedConnection] = []
+    def __init__(self, redis_url: Optional[str] = None):
+        # Every live connection keyed by its socket, plus role-based indexes so each
+        # broadcast only touches its recipients and disconnects are O(1)
+        self.by_ws: Dict[WebSocket, AuthenticatedConnection] = {}
+        self.admins: Set[AuthenticatedConnection] = set()
+        self.tourists_by_trip: Dict[int, Set[AuthenticatedConnection]] = {}  # trip ID -> tourist connections
+        self.tourists_by_guide: Dict[int, Set[AuthenticatedConnection]] = {}  # guide ID -> tourist connections
+        self.guides_by_trip: Dict[int, Set[AuthenticatedConnection]] = {}  # trip ID -> supervising guide connections
+        # Redis backplane (only when a URL is configured); broadcasts are published and
+        # every worker's relay task delivers them to its own connections
+        self.redis_url = redis_url
+        self.redis = None
+        self.relay_task: Optional[asyncio.Task] = None
+        # True only while the relay is subscribed; otherwise broadcasts are also delivered locally
+        self.relay_connected = False
+        # Last broadcast (latitude, longitude, status) per trip with its send time, to drop repeated GPS fixes
+        self._last_location: "OrderedDict[int, Tuple[tuple, float]]" = OrderedDict()
+
+    async def start_backplane(self):
+        """Connect to Redis and start relaying published broadcasts to local connections"""
+        if not self.redis_url or self.redis is not None:
+            return
+        import redis.asyncio as aioredis  # only required when REDIS_URL is set
+        self.redis = aioredis.from_url(self.redis_url)
+        self.relay_task = asyncio.create_task(self._relay_loop())
+
+    async def stop_backplane(self):
+        """Stop the relay task and close the Redis connection"""
+        if self.relay_task is not None:
+            self.relay_task.cancel()
+            self.relay_task = None
+        if self.redis is not None:
+            await self.redis.aclose()
+            self.redis = None
+
+    async def _relay_loop(self):
+        """Deliver every message published on the backplane to this worker's connections, resubscribing on failure"""
+        delay = BACKPLANE_RETRY_MIN
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(ADMIN_CHANNEL, WS_CONTEXT_CHANNEL)
+                await pubsub.psubscribe(f"{LOCATION_CHANNEL}:*", f"{GUIDE_LOCATION_CHANNEL}:*")
+                # Invalidations published while the relay was down were missed, so start from a cold routing cache
+                clear_ws_context()
+                self.relay_connected = True
+                delay = BACKPLANE_RETRY_MIN
+                async for item in pubsub.listen():
+                    if item["type"] in ("message", "pmessage"):
+                        await self._relay(item["channel"].decode(), item["data"])
+                print(f"Redis relay subscription ended, delivering locally; resubscribing in {delay}s")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis relay failed, delivering locally; resubscribing in {delay}s: {e}")
+            finally:
+                self.relay_connected = False
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BACKPLANE_RETRY_MAX)
+
+    async def _relay(self, channel: str, data: bytes):
+        """Handle one backplane message; a bad message is logged without dropping the subscription"""
+        try:
+            if channel == WS_CONTEXT_CHANNEL:
+                invalidate_ws_context(*orjson.loads(data))
+            else:
+                await self._deliver(channel, data)
+        except Exception as e:
+            print(f"Dropped backplane message on {channel}: {e}")
+
+    async def _publish(self, channel: str, message: bytes):
+        """Publish on the backplane, or deliver in-process when running without Redis"""
+        if self.redis is not None:
+            try:
+                await self.redis.publish(channel, message)
+                if self.relay_connected:
+                    return
+                # Other workers still get the publish; this worker's relay is down, so deliver here as well
+            except Exception as e:
+                print(f"Redis publish failed, delivering locally: {e}")
+        await self._deliver(channel, message)
+
+    async def invalidate_ws_context(self, *user_ids: Optional[int]):
+        """Drop cached WebSocket routing for these users here and, through the backplane, on every other worker"""
+        invalidate_ws_context(*user_ids)
+        if self.redis is not None:
+            try:
+                await self.redis.publish(WS_CONTEXT_CHANNEL, orjson.dumps([user_id for user_id in user_ids if user_id is not None]))
+            except Exception as e:
+                print(f"Redis publish failed, routing cache cleared locally only: {e}")
+
+    async def _deliver(self, channel: str, message: bytes):
+        """Route a broadcast to the local connections subscribed to its channel"""
+        kind, _, key = channel.partition(":")
+        # Admins see every broadcast
+        await _enqueue_all(self.admins, message)
+        if kind == LOCATION_CHANNEL:
+            trip_id = int(key)
+            await self.send_to_trip(trip_id, message)
+            await self.send_to_assigned_guides(trip_id, message)
+        elif kind == GUIDE_LOCATION_CHANNEL:
+            # Tourists who have this guide assigned to their active trip
+            await _enqueue_all(self.tourists_by_guide.get(int(key), ()), message)
 
     async def connect(self, websocket: WebSocket, user: User, trip: Optional[Trip] = None, assigned_trip_ids: Optional[List[int]] = None):
         """Connect an authenticated user with WebSocket"""
         await websocket.accept()
         connection = AuthenticatedConnection(websocket, user, trip, assigned_trip_ids)
-        self.active_connections.append(connection)
+        connection.writer_task = asyncio.create_task(self._writer_loop(connection))
+        self.by_ws[websocket] = connection
+        self._index(connection)
         return connection
 
+    def _index(self, connection: AuthenticatedConnection):
+        """Add a connection to the role buckets it should receive broadcasts from"""
+        if connection.role is Role.ADMIN:
+            self.admins.add(connection)
+        elif connection.role is Role.TOURIST:
+            if connection.trip_id is not None:
+                _add_to_bucket(self.tourists_by_trip, connection.trip_id, connection)
+            if connection.guide_id is not None:
+                _add_to_bucket(self.tourists_by_guide, connection.guide_id, connection)
+        elif connection.role is Role.GUIDE:
+            for trip_id in connection.assigned_trip_ids:
+                _add_to_bucket(self.guides_by_trip, trip_id, connection)
+
+    def _unindex(self, connection: AuthenticatedConnection):
+        """Remove a connection from every role bucket"""
+        self.admins.discard(connection)
+        if connection.trip_id is not None:
+            _discard_from_bucket(self.tourists_by_trip, connection.trip_id, connection)
+        if connection.guide_id is not None:
+            _discard_from_bucket(self.tourists_by_guide, connection.guide_id, connection)
+        for trip_id in connection.assigned_trip_ids:
+            _discard_from_bucket(self.guides_by_trip, trip_id, connection)
+
     def disconnect(self, websocket: WebSocket):
         """Disconnect WebSocket and remove from active connections"""
-        self.active_connections = [
-            conn for conn in self.active_connections 
-            if conn.websocket != websocket
-        ]
+        connection = self.by_ws.pop(websocket, None)
+        if connection is None:
+            return
+        self._unindex(connection)
+        if connection.writer_task is not None and connection.writer_task is not asyncio.current_task():
+            connection.writer_task.cancel()
+
+    async def _writer_loop(self, connection: AuthenticatedConnection):
+        """
+        Drain a connection's outbox, coalescing bursts of messages into a single frame.
+        Several pending messages are sent as {"type": "batch", "items": [...]}; clients unwrap them.
+        """
+        outbox = connection.outbox
+        try:
+            while True:
+                message = await outbox.get()
+                if WS_FLUSH_INTERVAL > 0 and outbox.empty():
+                    # Give a burst of broadcasts a moment to accumulate into one frame
+                    await asyncio.sleep(WS_FLUSH_INTERVAL)
+
+                batch = [message]
+                batch_size = len(message)
+                while batch_size < WS_FLUSH_BYTES and not outbox.empty():
+                    message = outbox.get_nowait()
+                    batch.append(message)
+                    batch_size += len(message)
+
+                if len(batch) == 1:
+                    frame = batch[0]
+                else:
+                    # Items are already JSON documents, so splice them in rather than re-encoding
+                    frame = b'{"type":"batch","items":[' + b",".join(batch) + b"]}"
+                await connection.websocket.send_bytes(frame)
+        except Exception:
+            # The socket is gone - stop writing and forget the connection
+            self.disconnect(connection.websocket)
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
+    async def send_personal_message(self, message: Union[dict, bytes], websocket: WebSocket):
         """Send message to specific WebSocket"""
-        await websocket.send_text(message)
+        await websocket.send_bytes(encode_message(message))
 
-    async def broadcast_to_admins(self, message: str):
+    async def broadcast_to_admins(self, message: bytes):
         """Broadcast message only to admin users"""
-        connections_to_remove = []
-        
-        for connection in self.active_connections.copy():
-            if str(connection.user.role) == "admin":
-                try:
-                    await connection.websocket.send_text(message)
-                except Exception as e:
-                    connections_to_remove.append(connection)
-        
-        # Remove disconnected connections
-        for connection in connections_to_remove:
-            if connection in self.active_connections:
-                self.active_connections.remove(connection)
-
-    async def send_to_trip(self, trip_id: int, message: str):
+        await self._publish(ADMIN_CHANNEL, message)
+
+    async def send_to_trip(self, trip_id: int, message: bytes):
         """Send message to specific trip by their trip ID"""
-        connections_to_remove = []
-        
-        for connection in self.active_connections.copy():
-            # Check if this connection belongs to the target trip
-            if (connection.trip is not None and int(str(connection.trip.id)) == trip_id):
-                try:
-                    await connection.websocket.send_text(message)
-                except Exception as e:
-                    connections_to_remove.append(connection)
-        
-        # Remove disconnected connections
-        for connection in connections_to_remove:
-            if connection in self.active_connections:
-                self.active_connections.remove(connection)
-
-    async def broadcast_location_update(self, trip_id: int, location_data: dict):
+        await _enqueue_all(self.tourists_by_trip.get(trip_id, ()), message)
+
+    def _is_duplicate_location(self, trip_id: int, location_data: dict) -> bool:
+        """True if this trip already broadcast the same position and status within WS_DUPLICATE_WINDOW"""
+        fix = (location_data.get("latitude"), location_data.get("longitude"), location_data.get("status"))
+        now = time.monotonic()
+        last = self._last_location.get(trip_id)
+        if last is not None and last[0] == fix and now - last[1] < WS_DUPLICATE_WINDOW:
+            return True
+        self._last_location[trip_id] = (fix, now)
+        self._last_location.move_to_end(trip_id)
+        if len(self._last_location) > WS_DUPLICATE_CACHE_SIZE:
+            self._last_location.popitem(last=False)
+        return False
+
+    async def broadcast_location_update(self, trip_id: int, location_data: Union[dict, bytes]):
         """
         Broadcast location update with role-based filtering:
         - Admin users: receive all trip location updates
         - Tourist users: only receive their own trip location updates
         - Guide users: receive location updates for trips they are assigned to
         """
-        message = json.dumps(location_data)
-        
-        # Send to all admin users
-        await self.broadcast_to_admins(message)
-        
-        # Send to the specific trip whose location was updated
-        await self.send_to_trip(trip_id, message)
-        
-        # Send to guides assigned to this trip
-        await self.send_to_assigned_guides(trip_id, message)
-
-    async def send_to_assigned_guides(self, trip_id: int, message: str):
+        if isinstance(location_data, dict) and self._is_duplicate_location(trip_id, location_data):
+            return
+
+        # Serialized once and published once on the trip's topic; _deliver fans it out to admins, the trip and its guides
+        await self._publish(f"{LOCATION_CHANNEL}:{trip_id}", encode_message(location_data))
+
+    async def send_to_assigned_guides(self, trip_id: int, message: bytes):
         """Send message to guides assigned to a specific trip"""
-        connections_to_remove = []
-        
-        for connection in self.active_connections.copy():
-            # Check if this is a guide connection and if they are assigned to this trip
-            if (str(connection.user.role) == "guide" and 
-                trip_id in connection.assigned_trip_ids):
-                try:
-                    await connection.websocket.send_text(message)
-                except Exception as e:
-                    connections_to_remove.append(connection)
-        
-        # Remove disconnected connections
-        for connection in connections_to_remove:
-            if connection in self.active_connections:
-                self.active_connections.remove(connection)
-
-    async def broadcast_guide_location_update(self, guide_id: int, guide_data: dict):
+        await _enqueue_all(self.guides_by_trip.get(trip_id, ()), message)
+
+    async def broadcast_guide_location_update(self, guide_id: int, guide_data: Union[dict, bytes]):
         """
         Broadcast guide location update with role-based filtering:
         - Admin users: receive all guide location updates
         - Tourist users: only receive their assigned guide's location updates
         - Guide users: do NOT receive other guides' locations (privacy)
         """
-        message = json.dumps(guide_data)
-        connections_to_remove = []
-        
-        # Send to all admin users (they see all guides)
-        await self.broadcast_to_admins(message)
-        
-        # Send to tourists who have this guide assigned to their active trip
-        for connection in self.active_connections.copy():
-            if str(connection.user.role) == "tourist":
-                # Check if this tourist has an active trip with the specific guide
-                if (connection.trip is not None and 
-                    connection.trip.guide_id is not None and
-                    int(str(connection.trip.guide_id)) == guide_id):
-                    try:
-                        await connection.websocket.send_text(message)
-                    except Exception as e:
-                        connections_to_remove.append(connection)
-        
-        # Remove disconnected connections
-        for connection in connections_to_remove:
-            if connection in self.active_connections:
-                self.active_connections.remove(connection)
-
-    async def broadcast(self, message: str):
+        # Published once on the guide's topic; _deliver fans it out to admins and assigned tourists
+        await self._publish(f"{GUIDE_LOCATION_CHANNEL}:{guide_id}", encode_message(guide_data))
+
+    async def broadcast(self, message: Union[dict, bytes]):
         """Legacy broadcast method - sends to all connections (deprecated for security)"""
-        connections_to_remove = []
-        
-        for connection in self.active_connections.copy():
-            try:
-                await connection.websocket.send_text(message)
-            except Exception as e:
-                connections_to_remove.append(connection)
-        
-        # Remove disconnected connections
-        for connection in connections_to_remove:
-            if connection in self.active_connections:
-                self.active_connections.remove(connection)
\ No newline at end of file
+        # Encoded once, shared by every outbox
+        await _enqueue_all(self.by_ws.values(), encode_message(message))